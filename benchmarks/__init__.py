@@ -0,0 +1,10 @@
+"""
+Benchmarks for the database and the game views built from it.
+
+Run from the folder with config.yml:
+    python -m benchmarks --members 2000 --tags 1500 --output benchmark_results.json
+
+A synthetic game is generated into a temporary database, so the real game database is never touched.
+Add --in-memory to keep that database in memory, which leaves out disk costs.
+Compare the JSON files between releases to catch regressions.
+"""
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, Any, List
+
+import sqlalchemy
+from loguru import logger
+
+from discord_hvz import display
+from discord_hvz.config import config
+from discord_hvz.database import HvzDb
+from discord_hvz.main import VERSION
+from discord_hvz.member_cache import MemberCache
+from discord_hvz.sheets import SheetsInterface
+from discord_hvz.utilities import generate_tag_tree, divide_string
+from benchmarks.synthetic_game import generate_game, prepare_tables, SyntheticGame
+
+
+def measure(function: Callable, repeat: int = 5, number: int = 1) -> Dict[str, Any]:
+    """
+    Calls the function number times in each of repeat rounds and returns per-call timings in milliseconds.
+    The minimum is the most repeatable number to compare between runs.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) * 1000 / number)
+    return {
+        'min_ms': min(samples),
+        'median_ms': statistics.median(samples),
+        'mean_ms': statistics.fmean(samples),
+        'max_ms': max(samples),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+class StubSpreadsheets:
+    """Stands in for the Sheets API, so an export measures only reading and serializing the table."""
+
+    def __init__(self):
+        self.last_body = None
+
+    def values(self):
+        return self
+
+    def batchClear(self, body, **kwargs):
+        return SimpleNamespace(execute=lambda: {})
+
+    def batchUpdate(self, body, **kwargs):
+        self.last_body = body
+        cells = sum(len(row) for entry in body['data'] for row in entry['values'])
+        return SimpleNamespace(execute=lambda: {'totalUpdatedCells': cells})
+
+
+def make_stub_sheets(db: HvzDb) -> SheetsInterface:
+    return SheetsInterface(db, spreadsheets=StubSpreadsheets(), sheet_id='benchmark')
+
+
+def make_stub_bot(game: SyntheticGame) -> SimpleNamespace:
+    """Just enough of HVZBot for generate_tag_tree: the zombie role's members, and no one still on the server."""
+    zombie_members = [SimpleNamespace(id=int(member_id)) for member_id in game.zombie_ids]
+    return SimpleNamespace(
+        roles={'zombie': SimpleNamespace(members=zombie_members)},
+        get_member=lambda member_id: None
+    )
+
+
+def run_benchmarks(db: HvzDb, game: SyntheticGame, repeat: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+
+    def run(name: str, function: Callable, number: int = 1) -> None:
+        try:
+            results[name] = measure(function, repeat=repeat, number=number)
+        except Exception as e:
+            # Such as a plot when kaleido can't run here. The other benchmarks are still worth having.
+            logger.warning(f'The benchmark "{name}" failed: {e}')
+            results[name] = {'error': repr(e)}
+            return
+        logger.info(f'{name}: {results[name]["min_ms"]:.3f} ms')
+
+    rows = game.member_rows
+    lookups = 200
+    for column in (*MemberCache.indexed_columns, 'email'):
+        if column not in db.tables['members'].c:
+            continue
+        values = [row[column] for row in rows[:lookups]]
+        run(f'get_member.{column}', lambda values=values, column=column: [db.get_member(v, column) for v in values])
+        results[f'get_member.{column}']['lookups'] = len(values)
+
+    day_start = game.end_time - timedelta(days=1)
+    run('get_rows.tags_last_day', lambda: db.get_rows(
+        'tags', 'tag_time', lower_value=day_start, upper_value=game.end_time
+    ))
+    run('count_rows.tags_last_day', lambda: db.count_rows(
+        'tags', 'tag_time', lower_value=day_start, upper_value=game.end_time
+    ))
+    registration_start = game.start_time - timedelta(days=1)
+    run('get_rows.members_registered_last_day', lambda: db.get_rows(
+        'members', 'registration_time', lower_value=registration_start, upper_value=game.start_time
+    ))
+
+    bot = make_stub_bot(game)
+    run('generate_tag_tree', lambda: generate_tag_tree(db, bot))
+    tree = generate_tag_tree(db, bot)
+    run('divide_string.tag_tree', lambda: divide_string(tree), number=10)
+
+    def plot():
+        display.LAST_GAME_PLOT_HASH = None  # Otherwise an unchanged game skips drawing
+        display.create_game_plot(db)
+    run('create_game_plot', plot)
+
+    sheets = make_stub_sheets(db)
+    for table_name in config['sheet_names']:
+        def full_export(table_name=table_name):
+            sheets.snapshots.pop(table_name, None)  # As on the first export of a table
+            sheets._export(table_name)
+        run(f'sheets_export.{table_name}', full_export)
+        # With the snapshot from the last run in place, nothing has changed and nothing is sent
+        run(f'sheets_export_unchanged.{table_name}', lambda table_name=table_name: sheets._export(table_name))
+    sheets.close()
+    return results
+
+
+def main(arguments: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Times HvzDb and game views on a synthetic game.')
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--tags', type=int, default=400)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--panels', type=int, default=3)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='Rounds per benchmark. The fastest round is the headline.')
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    parser.add_argument(
+        '--in-memory', action='store_true',
+        help='Keep the database in memory. Faster and repeatable, but leaves out the cost of writing to disk.'
+    )
+    args = parser.parse_args(arguments)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.in_memory:
+            db = HvzDb.in_memory(database_config=config['database_tables'])
+        else:
+            db = HvzDb(filepath=Path(directory) / 'benchmark.db', sheet_export=False)
+        try:
+            prepare_tables(db)
+            start = time.perf_counter()
+            game = generate_game(
+                db, members=args.members, tags=args.tags, items=args.items, panels=args.panels,
+                days=args.days, seed=args.seed
+            )
+            logger.info(f'Generated the game in {time.perf_counter() - start:.2f} s')
+            results = run_benchmarks(db, game, args.repeat)
+        finally:
+            db.close()
+
+    output = {
+        'discord_hvz_version': VERSION,
+        'python_version': platform.python_version(),
+        'sqlalchemy_version': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'time': datetime.now(tz=config.time_zone).isoformat(),
+        'arguments': {k: str(i) if isinstance(i, Path) else i for k, i in vars(args).items()},
+        'results': results
+    }
+    args.output.write_text(json.dumps(output, indent=2))
+    logger.info(f'Saved the results to {args.output}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
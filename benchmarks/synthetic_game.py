@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import random
+import string
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Dict, TYPE_CHECKING
+
+from sqlalchemy import Column, String, Boolean, Integer
+
+from discord_hvz.config import config
+from discord_hvz.display import panel_table_columns
+from discord_hvz import item_tracker
+
+if TYPE_CHECKING:
+    from discord_hvz.database import HvzDb
+
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Casey', 'Riley', 'Morgan', 'Jamie', 'Quinn', 'Avery', 'Drew', 'Parker']
+LAST_NAMES = ['Smith', 'Garcia', 'Kim', 'Nguyen', 'Patel', 'Brown', 'Lopez', 'Chen', 'Okafor', 'Novak', 'Haddad', 'Ito']
+
+
+@dataclass
+class SyntheticGame:
+    """What was generated, so benchmarks can pick realistic lookup values."""
+    start_time: datetime
+    end_time: datetime
+    member_ids: List[str] = field(default_factory=list)
+    oz_ids: List[str] = field(default_factory=list)
+    zombie_ids: List[str] = field(default_factory=list)
+    member_rows: List[Dict] = field(default_factory=list)
+
+
+def generate_game(
+        db: HvzDb,
+        members: int = 500,
+        tags: int = 400,
+        items: int = 50,
+        panels: int = 3,
+        days: int = 7,
+        oz_fraction: float = 0.02,
+        seed: int = 0
+) -> SyntheticGame:
+    """
+    Fills the database with a game: members who registered before it began, a few OZs, and tags made by zombies on
+    humans over the game's days, so each tag extends the tag tree's lineage. Also adds items and panels.
+    The database must have its tables created, and should be empty.
+    """
+    rng = random.Random(seed)
+    start_time = datetime.now(tz=config.time_zone).replace(microsecond=0) - timedelta(days=days)
+    game = SyntheticGame(start_time=start_time, end_time=start_time + timedelta(days=days))
+
+    # Members
+    columns = db.get_column_names('members')
+    used_codes = set()
+    for i in range(members):
+        member_id = str(100000000000000000 + rng.randrange(10 ** 17))
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        row = {
+            'id': member_id,
+            'name': f'{first} {last}',
+            'nickname': f'{first}{i}',
+            'discord_name': f'{first.lower()}_{last.lower()}{i}',
+            'faction': 'human',
+            'tag_code': _unique_code(rng, used_codes),
+            'registration_time': start_time - timedelta(minutes=rng.randrange(60 * 24 * 14)),
+            'oz': False,
+        }
+        # Free-text columns from the config get filler, so rows are as wide as a real game's
+        for column in columns:
+            if column not in row:
+                row[column] = _filler(rng, db.tables['members'].c[column])
+        game.member_ids.append(member_id)
+        game.member_rows.append(row)
+
+    oz_count = max(1, int(members * oz_fraction))
+    for row in rng.sample(game.member_rows, oz_count):
+        row['oz'] = True
+        row['faction'] = 'zombie'
+        game.oz_ids.append(row['id'])
+
+    # Tags. Every tag is made by a current zombie on a current human, in time order.
+    rows_by_id = {row['id']: row for row in game.member_rows}
+    zombies = list(game.oz_ids)
+    oz_ids = set(game.oz_ids)
+    humans = [member_id for member_id in game.member_ids if member_id not in oz_ids]
+    tag_rows = []
+    tag_times = sorted(start_time + timedelta(seconds=rng.randrange(days * 24 * 3600)) for _ in range(tags))
+    for tag_time in tag_times:
+        if not humans:
+            break
+        tagger = rows_by_id[rng.choice(zombies)]
+        tagged = rows_by_id[humans.pop(rng.randrange(len(humans)))]
+        tagged['faction'] = 'zombie'
+        zombies.append(tagged['id'])
+        tag_rows.append({
+            'tagger_id': tagger['id'],
+            'tagger_name': tagger['name'],
+            'tagger_nickname': tagger['nickname'],
+            'tagger_discord_name': tagger['discord_name'],
+            'tagged_id': tagged['id'],
+            'tagged_name': tagged['name'],
+            'tagged_nickname': tagged['nickname'],
+            'tagged_discord_name': tagged['discord_name'],
+            'tag_time': tag_time,
+            'report_time': tag_time + timedelta(minutes=rng.randrange(1, 90)),
+            'revoked_tag': rng.random() < 0.02
+        })
+    game.zombie_ids = zombies
+
+    tag_columns = set(db.get_column_names('tags'))
+    tag_rows = [{k: i for k, i in row.items() if k in tag_columns} for row in tag_rows]
+    member_columns = set(columns)
+    member_rows = [{k: i for k, i in row.items() if k in member_columns} for row in game.member_rows]
+
+    with db.transaction():
+        db.add_rows('members', member_rows)
+        if tag_rows:
+            db.add_rows('tags', tag_rows)
+        if items and item_tracker.table_name in db.tables:
+            db.add_rows(item_tracker.table_name, [
+                {'name': f'Item {i}', 'owner': int(rng.choice(game.member_ids)) if rng.random() < 0.8 else 0}
+                for i in range(items)
+            ])
+        if panels and 'persistent_panels' in db.tables:
+            db.add_rows('persistent_panels', [
+                {'channel_id': 900000000000000000 + i, 'message_id': 800000000000000000 + i,
+                 'elements': 'PlayerCountElement,TagsTodayElement,GamePlotElement'}
+                for i in range(panels)
+            ])
+    return game
+
+
+def prepare_tables(db: HvzDb) -> None:
+    """Prepares the tables that cogs normally make, then creates every table."""
+    db.prepare_table(item_tracker.table_name, columns=item_tracker.table_columns, indexes=['owner'])
+    db.prepare_table('persistent_panels', columns=panel_table_columns, indexes=['message_id'])
+    db.create_tables()
+
+
+def _unique_code(rng: random.Random, used_codes: set) -> str:
+    while True:
+        code = ''.join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+        if code not in used_codes:
+            used_codes.add(code)
+            return code
+
+
+def _filler(rng: random.Random, column: Column):
+    if isinstance(column.type, String):
+        return ' '.join(rng.choice(FIRST_NAMES + LAST_NAMES) for _ in range(rng.randrange(1, 12)))
+    if isinstance(column.type, Boolean):
+        return rng.random() < 0.5
+    if isinstance(column.type, Integer):
+        return rng.randrange(1000)
+    return None
@@ -24,6 +24,8 @@ The below processors run critical parts of the bot and should not be edited with
 You should use them as examples though.
 
 Each processor function is called immediately when a user submits their response to a question.
+A processor may be a normal function or an async function. Use an async function, and the awaitable database methods
+such as bot.db.aget_member(), when the processor needs the database.
 The processor is passed all arguments by name, and only these arguments:
 input_text: A string containing the text the user submitted
 bot: The HVZBot object that is running the chat. From this, many bot features may be accessed.
@@ -49,9 +51,9 @@ def name(input_text: str, bot: HVZBot):
 def generate_tag_code(input_text: str, bot: HVZBot) -> str:
     return make_tag_code(bot.db)
 
-def tag_code_to_member_id(input_text: str, bot: HVZBot) -> str:
+async def tag_code_to_member_id(input_text: str, bot: HVZBot) -> str:
     try:
-        tagged_member_row: sqlalchemy.engine.Row = bot.db.get_member(input_text.upper(), column='Tag_Code')
+        tagged_member_row: sqlalchemy.engine.Row = await bot.db.aget_member(input_text.upper(), column='Tag_Code')
     except ValueError:
         raise ValueError('This tag code didn\'t match a user')
 
@@ -15,6 +15,8 @@ if TYPE_CHECKING:
 # column names to values).
 # If any of these processor functions return a ValueError exception, the error message will be displayed to the user.
 # All other exceptions are reported to them as generic errors.
+# An ending function runs inside the database transaction that saves the chatbot's responses, so its database writes
+# are committed along with them, or not at all. Make database calls after any Discord calls in an ending function.
 
 
 async def registration_end(responses: Dict[str, Any], bot: HVZBot, target_member: discord.Member) -> Dict[str, Any]:
@@ -25,19 +27,22 @@ async def registration_end(responses: Dict[str, Any], bot: HVZBot, target_member
     responses['nickname'] = target_member.nick
     responses['registration_time'] = datetime.now(tz=config.time_zone)
     responses['oz'] = False
-    responses['tag_code'] = make_tag_code(bot.db)
 
     await target_member.add_roles(bot.roles['player'])
     await target_member.add_roles(bot.roles['human'])
 
+    # This processor runs inside the database transaction that saves the chatbot.
+    # Making a tag code doesn't use the database, so it doesn't open the transaction before the chatbot saves.
+    responses['tag_code'] = make_tag_code(bot.db)
+
     return responses
 
 async def tag_logging_end(responses: Dict[str, Any], bot: HVZBot, target_member: discord.Member) -> Dict[str, Any]:
 
     tagged_member = bot.get_member(responses['tagged_id'])
-    tagged_member_row = bot.db.get_member(tagged_member)
+    tagged_member_row = await bot.db.aget_member(tagged_member)
     tagger_member = target_member
-    tagger_member_row = bot.db.get_member(tagger_member)
+    tagger_member_row = await bot.db.aget_member(tagger_member)
 
     responses['tagged_name'] = tagged_member_row.name
     responses['tagged_discord_name'] = tagged_member.name
@@ -52,8 +57,9 @@ async def tag_logging_end(responses: Dict[str, Any], bot: HVZBot, target_member:
 
     await tagged_member.add_roles(bot.roles['zombie'])
     await tagged_member.remove_roles(bot.roles['human'])
-    bot.db.edit_row('members', 'id', tagged_member.id, 'faction', 'zombie')
     await bot.announce_tag(tagged_member, tagger_member, responses['tag_time'])
+    # Saved in the same commit as the tag itself, since this runs in the chatbot's transaction
+    await bot.db.aedit_row('members', 'id', tagged_member.id, 'faction', 'zombie')
 
     # Try to make a useful console output, but don't worry if it fails.
     try:
@@ -65,7 +71,7 @@ async def tag_logging_end(responses: Dict[str, Any], bot: HVZBot, target_member:
 
 async def registration_start(member: discord.Member, bot: HVZBot) -> None:
     try:
-        bot.db.get_member(member)
+        await bot.db.aget_member(member)
     except ValueError:
         # If the database can't find the user, then we can continue with registration
         return
@@ -76,6 +82,6 @@ async def tag_logging_start(member: discord.Member, bot: HVZBot) -> None:
     if config['tag_logging'] is False:
         raise ValueError('The admin has not enabled tagging yet.')
     try:
-        bot.db.get_member(member)
+        await bot.db.aget_member(member)
     except ValueError as e:
         raise ValueError('You are not currently registered for HvZ.')
\ No newline at end of file
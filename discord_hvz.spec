@@ -14,7 +14,8 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[(dateutil_path, 'dateutil')],
-    hiddenimports=[],
+    # The archive cog imports pyarrow only if it is installed, so it is named here to make sure it is bundled
+    hiddenimports=['pyarrow', 'pyarrow.ipc'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
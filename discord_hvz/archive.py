@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import json
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
+
+import discord
+from discord.commands import SlashCommandGroup, Option
+from discord.ext import commands
+from loguru import logger
+from sqlalchemy import Table, Column, Integer, Boolean, DateTime
+
+from .column_types import Timestamp
+from .config import config
+from . import item_tracker
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+if TYPE_CHECKING:
+    from main import HVZBot
+    from database import HvzDb
+
+guild_id_list = [config['server_id']]
+
+DEFAULT_ARCHIVE_SETTINGS: Dict[str, Any] = {
+    'folder': 'archives',
+    'compression': 'zstd'
+}
+
+# The tables an archive holds, and which of them are emptied when the live tables are truncated.
+# Panels are archived but kept, since their messages are still on the server.
+ARCHIVE_TABLES = ['members', 'tags', item_tracker.table_name, 'persistent_panels']
+TRUNCATED_TABLES = ['members', 'tags', item_tracker.table_name]
+
+MANIFEST_NAME = 'game.json'
+ARCHIVE_BATCH_SIZE = 2000
+
+
+def load_archive_settings() -> Dict[str, Any]:
+    settings = config.section('game_archive', DEFAULT_ARCHIVE_SETTINGS)
+    if str(settings['compression']).casefold() in ('none', 'false', ''):
+        settings['compression'] = None
+    return settings
+
+
+def archive_folder() -> Path:
+    return config.path_root / load_archive_settings()['folder']
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError('Archiving games needs the pyarrow package. Install it with "pip install pyarrow".')
+
+
+def _arrow_type(column: Column) -> pa.DataType:
+    if isinstance(column.type, (Timestamp, DateTime)):
+        return pa.timestamp('s', tz='UTC')
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    return pa.string()
+
+
+def _arrow_value(value: Any, arrow_type: pa.DataType) -> Any:
+    """Converts a value read from the database to what pyarrow expects for the column."""
+    if value is None:
+        return None
+    if pa.types.is_timestamp(arrow_type):
+        return Timestamp.to_epoch(value)
+    if pa.types.is_string(arrow_type):
+        # SQLite lets any value into a String column, such as the booleans in revoked_tag
+        return str(value)
+    return value
+
+
+def _write_table(db: HvzDb, table: Table, path: Path, metadata: Dict[str, str], compression: Optional[str]) -> int:
+    """Writes a table to an Arrow IPC file a batch at a time. Returns the number of rows written."""
+    schema = pa.schema([pa.field(column.name, _arrow_type(column)) for column in table.columns], metadata=metadata)
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    row_count = 0
+    with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+        batch = []
+        for row in db.iter_rows(table.name, batch_size=ARCHIVE_BATCH_SIZE):
+            batch.append(row)
+            if len(batch) >= ARCHIVE_BATCH_SIZE:
+                writer.write_batch(_record_batch(batch, schema))
+                row_count += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(_record_batch(batch, schema))
+            row_count += len(batch)
+    return row_count
+
+
+def _record_batch(rows: List, schema: pa.Schema) -> pa.RecordBatch:
+    arrays = [
+        pa.array([_arrow_value(row[i], field.type) for row in rows], type=field.type)
+        for i, field in enumerate(schema)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def archive_game(db: HvzDb, name: str, truncate: bool = False, folder: Path = None) -> Path:
+    """
+    Writes the game's tables to compressed Arrow IPC (Feather) files in their own folder, along with a game.json
+    describing the game. If truncate is True, the live game tables are then emptied, in the same transaction as the
+    reads so that nothing can be lost between them. Returns the archive's folder.
+    Runs synchronously, so call it with HvzDb.arun() from the bot.
+    """
+    _require_pyarrow()
+    settings = load_archive_settings()
+    slug = re.sub(r'[^a-z0-9_-]+', '-', name.strip().casefold()).strip('-')
+    if not slug:
+        raise ValueError(f'"{name}" cannot be used as an archive name. Use letters and numbers.')
+    destination = (folder or archive_folder()) / slug
+    if destination.exists():
+        raise ValueError(f'There is already an archive called "{slug}".')
+
+    archived_time = datetime.now(tz=config.time_zone)
+    manifest = {
+        'name': name,
+        'archived_time': archived_time.isoformat(),
+        'compression': settings['compression'],
+        'truncated': truncate,
+        'tables': {}
+    }
+    partial = destination.with_name(destination.name + '.partial')
+    shutil.rmtree(partial, ignore_errors=True)  # Left over from an interrupted archive
+    partial.mkdir(parents=True)
+    try:
+        with db.transaction():
+            for table_name in ARCHIVE_TABLES:
+                table = db.tables.get(table_name)
+                if table is None:
+                    continue
+                file_name = f'{table_name}.arrow'
+                metadata = {'game': name, 'table': table_name, 'archived_time': archived_time.isoformat()}
+                row_count = _write_table(db, table, partial / file_name, metadata, settings['compression'])
+                manifest['tables'][table_name] = {'file': file_name, 'rows': row_count}
+            _add_game_times(db, manifest)
+            (partial / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+            if truncate:
+                for table_name in TRUNCATED_TABLES:
+                    if table_name in db.tables:
+                        db.delete_where(table_name)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    # Only given its final name once the truncation has committed, so a failed truncation leaves no archive behind
+    try:
+        partial.rename(destination)
+    except OSError:
+        # The tables may already be emptied, so the archive must not be deleted here
+        logger.error(f'The archive was written to {partial} but could not be renamed to {destination.name}. Rename it by hand.')
+        raise
+    logger.info(f'Archived the game "{name}" to {destination}.{" The live game tables were emptied." if truncate else ""}')
+    return destination
+
+
+def _add_game_times(db: HvzDb, manifest: Dict[str, Any]) -> None:
+    """Adds when the game began and ended, as the first registration and the last tag, if the tables have those times."""
+    for key, table_name, column_name, function in (
+            ('first_registration', 'members', 'registration_time', 'min'),
+            ('last_tag', 'tags', 'tag_time', 'max')
+    ):
+        if table_name not in db.tables or column_name not in db.tables[table_name].c:
+            continue
+        value = db.aggregate(table_name, function, column_name)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        manifest[key] = value
+
+
+def list_archives(folder: Path = None) -> List[Dict[str, Any]]:
+    """Returns the manifest of every archived game, oldest first, each with a 'path' added."""
+    folder = folder or archive_folder()
+    if not folder.exists():
+        return []
+    manifests = []
+    for manifest_path in folder.glob(f'*/{MANIFEST_NAME}'):
+        manifest = json.loads(manifest_path.read_text())
+        manifest['path'] = manifest_path.parent
+        manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest['archived_time'])
+
+
+def load_archive(path: Path) -> Dict[str, pa.Table]:
+    """
+    Loads an archived game's tables with memory mapping, so only the data used is read from disk.
+    Compressed archives are decompressed as they are read. Set 'compression' to none for zero-copy loading.
+    """
+    _require_pyarrow()
+    manifest = json.loads((path / MANIFEST_NAME).read_text())
+    tables = {}
+    for table_name, entry in manifest['tables'].items():
+        with pa.memory_map(str(path / entry['file']), 'r') as source:
+            tables[table_name] = pa.ipc.open_file(source).read_all()
+    return tables
+
+
+def setup(bot):  # this is called by Pycord to setup the cog
+    bot.add_cog(ArchiveCog(bot))  # add the cog to the bot
+
+
+class ArchiveCog(commands.Cog, guild_ids=guild_id_list):
+    """
+    Saves finished games out of the live database into archive files, which keeps the live database small.
+    """
+    archive_group = SlashCommandGroup('archive', 'Commands for archiving finished games', guild_ids=guild_id_list)
+
+    def __init__(self, bot: "HVZBot"):
+        self.bot = bot
+
+    @archive_group.command(name='game')
+    async def archive_game_command(
+            self,
+            ctx: discord.ApplicationContext,
+            name: Option(str, 'A name for the archive, such as "Fall 2023".'),
+            truncate: Option(bool, 'Empty the members, tags and items tables after archiving them.', default=False)
+    ):
+        """
+        Archives the members, tags, items and panels tables, and can empty them for a new game.
+
+        Emptying the tables doesn't change anyone's roles on the server.
+        """
+        await ctx.response.defer()
+        try:
+            destination = await self.bot.db.arun(archive_game, self.bot.db, name, truncate)
+        except (ValueError, RuntimeError) as e:
+            await ctx.respond(str(e))
+            return
+        except Exception as e:
+            logger.exception(e)
+            await ctx.respond(f'The archive failed, and the live tables were left as they were: {e}')
+            return
+        manifest = json.loads((destination / MANIFEST_NAME).read_text())
+        counts = ', '.join(f'{entry["rows"]} {table_name}' for table_name, entry in manifest['tables'].items())
+        msg = f'Archived "{name}" to `{destination.name}`: {counts}.'
+        if truncate:
+            msg += '\nThe members, tags and items tables are now empty.'
+        await ctx.respond(msg)
+
+    @archive_group.command(name='list')
+    async def archive_list(self, ctx: discord.ApplicationContext):
+        """
+        Lists the archived games.
+        """
+        manifests = list_archives()
+        if not manifests:
+            await ctx.respond('There are no archived games.')
+            return
+        lines = []
+        for manifest in manifests:
+            counts = ', '.join(f'{entry["rows"]} {table_name}' for table_name, entry in manifest['tables'].items())
+            lines.append(f'**{manifest["name"]}** (`{manifest["path"].name}`, {manifest["archived_time"][:10]}): {counts}')
+        await ctx.respond('\n'.join(lines))
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
+
+import discord
+from discord.commands import SlashCommandGroup
+from discord.ext import commands, tasks
+from loguru import logger
+
+from .config import config
+
+if TYPE_CHECKING:
+    from main import HVZBot
+
+guild_id_list = [config['server_id']]
+
+DEFAULT_BACKUP_SETTINGS: Dict[str, Any] = {
+    'enabled': True,
+    'interval_minutes': 60,
+    'keep': 24,
+    'folder': 'backups',
+    'pages_per_step': 1024,
+    'plots_use_backup': False
+}
+
+
+def load_backup_settings() -> Dict[str, Any]:
+    return config.section('database_backup', DEFAULT_BACKUP_SETTINGS)
+
+
+def backup_database(source: Path, destination: Path, pages_per_step: int = 1024, step_sleep: float = 0.005) -> None:
+    """
+    Copies a live SQLite database into a new file with SQLite's backup API, which always gives a consistent copy.
+    The copy is made a few pages at a time, and the source is unlocked between steps so the bot can keep writing.
+    The snapshot is written beside its destination first, so a half-made snapshot never has the final name.
+    """
+    temporary_path = destination.with_name(destination.name + '.partial')
+    source_connection = sqlite3.connect(source)
+    try:
+        destination_connection = sqlite3.connect(temporary_path)
+        try:
+            source_connection.backup(destination_connection, pages=pages_per_step, sleep=step_sleep)
+            # A snapshot is a single self-contained file, without the write-ahead log of the live database
+            destination_connection.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            destination_connection.close()
+    finally:
+        source_connection.close()
+    temporary_path.replace(destination)
+
+
+def setup(bot):  # this is called by Pycord to setup the cog
+    bot.add_cog(BackupCog(bot))  # add the cog to the bot
+
+
+class BackupCog(commands.Cog, guild_ids=guild_id_list):
+    """
+    Takes snapshots of the game database on a schedule while the bot runs, keeping the newest few.
+    """
+    backup_group = SlashCommandGroup('backup', 'Commands for backing up the game database', guild_ids=guild_id_list)
+
+    def __init__(self, bot: "HVZBot"):
+        self.bot = bot
+        self.settings = load_backup_settings()
+        self.folder: Path = config.path_root / self.settings['folder']
+        self.plots_use_backup: bool = bool(self.settings['plots_use_backup'])
+        self._lock = asyncio.Lock()
+
+        self.scheduled_backup.change_interval(minutes=float(self.settings['interval_minutes']))
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready can fire again after a reconnect
+        if self.settings['enabled'] and not self.scheduled_backup.is_running():
+            self.scheduled_backup.start()
+
+    def cog_unload(self) -> None:
+        self.scheduled_backup.cancel()
+
+    def snapshots(self) -> List[Path]:
+        """Returns the snapshot files, oldest first."""
+        if not self.folder.exists():
+            return []
+        return sorted(self.folder.glob(f'{self.bot.db.filepath.stem}-*.db'))
+
+    def latest_snapshot(self) -> Optional[Path]:
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    async def backup(self) -> Path:
+        """Takes a snapshot now and deletes the oldest ones beyond the number to keep. Returns the snapshot's path."""
+        async with self._lock:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            timestamp = datetime.now(tz=config.time_zone).strftime('%Y%m%d-%H%M%S')
+            destination = self.folder / f'{self.bot.db.filepath.stem}-{timestamp}.db'
+            start = time.perf_counter()
+            # Not on the database thread, so the bot's own database work carries on during the backup
+            await asyncio.get_running_loop().run_in_executor(
+                None, backup_database, self.bot.db.filepath, destination, int(self.settings['pages_per_step'])
+            )
+            logger.info(f'Backed up the database to {destination} in {time.perf_counter() - start:.2f} seconds.')
+
+            for old_snapshot in self.snapshots()[:-max(int(self.settings['keep']), 1)]:
+                old_snapshot.unlink(missing_ok=True)
+            return destination
+
+    @tasks.loop(minutes=60)
+    async def scheduled_backup(self):
+        try:
+            await self.backup()
+        except Exception as e:
+            logger.exception(f'The scheduled database backup failed: {e}')
+
+    @backup_group.command(name='now')
+    async def backup_now(self, ctx: discord.ApplicationContext):
+        """
+        Takes a snapshot of the game database right away.
+        """
+        await ctx.response.defer()
+        try:
+            snapshot = await self.backup()
+        except Exception as e:
+            logger.exception(e)
+            await ctx.respond(f'The backup failed: {e}')
+            return
+        size_kb = snapshot.stat().st_size / 1024
+        await ctx.respond(f'Backed up the database to `{snapshot.name}` ({size_kb:.0f} KB).')
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Tuple, Iterable, Optional, TYPE_CHECKING
+
+import sqlalchemy
+from sqlalchemy import select, delete, func
+
+from discord_hvz.config import config
+
+if TYPE_CHECKING:
+    from discord_hvz.database import HvzDb
+
+
+@dataclass(frozen=True)
+class Change:
+    """One row changed by one write. key is the row's primary key (or member id), or None if it couldn't be known."""
+    sequence: int
+    table: str
+    operation: str  # 'insert', 'update' or 'delete'
+    key: Optional[str]
+    columns: Tuple[str, ...]
+    timestamp: datetime
+
+
+class ChangeJournal:
+    """
+    A record of every row changed through HvzDb, kept in its own table and written in the same transaction as the change.
+    Each change gets an increasing sequence number. A consumer remembers the last sequence it handled and asks for
+    changes_since() that number, so it only has to process what changed instead of re-reading whole tables.
+    Old entries are pruned when the bot starts. Check covers() before trusting changes_since() for an old sequence.
+    """
+    table_name = 'change_journal'
+    columns: Dict[str, str] = {
+        'sequence': 'incrementing_integer',
+        'table_name': 'string',
+        'operation': 'string',
+        'row_key': 'string',
+        'changed_columns': 'string',
+        'timestamp': 'datetime'
+    }
+    max_entries = 50000
+
+    def __init__(self, db: HvzDb):
+        self.db = db
+        db.prepare_table(self.table_name, self.columns, indexes=['table_name'])
+        self.table = db.tables[self.table_name]
+
+    def record(self, conn: sqlalchemy.engine.Connection, table_name: str, operation: str, keys: Iterable,
+               columns: Iterable[str]) -> None:
+        """Adds one entry per key. Called by HvzDb with the connection that made the change."""
+        changed_columns = ','.join(columns)
+        timestamp = datetime.now(tz=config.time_zone)
+        entries = [
+            {
+                'table_name': table_name,
+                'operation': operation,
+                'row_key': None if key is None else str(key),
+                'changed_columns': changed_columns,
+                'timestamp': timestamp
+            }
+            for key in keys
+        ]
+        if entries:
+            conn.execute(self.table.insert(), entries)
+
+    def changes_since(self, sequence: int, table_name: str = None, limit: int = None) -> List[Change]:
+        """Returns changes with a sequence number greater than the one given, oldest first."""
+        selection = select(self.table).where(self.table.c.sequence > sequence).order_by(self.table.c.sequence)
+        if table_name is not None:
+            selection = selection.where(self.table.c.table_name == table_name)
+        if limit is not None:
+            selection = selection.limit(limit)
+        with self.db._connect() as conn:
+            rows = conn.execute(selection).all()
+        return [
+            Change(
+                sequence=row.sequence,
+                table=row.table_name,
+                operation=row.operation,
+                key=row.row_key,
+                columns=tuple(row.changed_columns.split(',')) if row.changed_columns else (),
+                timestamp=row.timestamp
+            )
+            for row in rows
+        ]
+
+    def latest_sequence(self, table_name: str = None) -> int:
+        """Returns the sequence number of the newest change, or 0 if there are none."""
+        selection = select(func.max(self.table.c.sequence))
+        if table_name is not None:
+            selection = selection.where(self.table.c.table_name == table_name)
+        with self.db._connect() as conn:
+            return conn.execute(selection).scalar() or 0
+
+    def covers(self, sequence: int) -> bool:
+        """
+        Returns False if entries after this sequence number have been pruned, in which case changes_since() is
+        incomplete and the consumer should re-read the whole table.
+        """
+        with self.db._connect() as conn:
+            oldest = conn.execute(select(func.min(self.table.c.sequence))).scalar()
+        return oldest is None or sequence >= oldest - 1
+
+    def prune(self) -> None:
+        """Deletes all but the newest max_entries entries."""
+        cutoff = self.latest_sequence() - self.max_entries
+        if cutoff <= 0:
+            return
+        with self.db._connect() as conn:
+            conn.execute(delete(self.table).where(self.table.c.sequence <= cutoff))
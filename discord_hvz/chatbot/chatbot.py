@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from inspect import isawaitable
 from pathlib import Path
 from typing import List, Dict, Any
 from typing import TYPE_CHECKING
@@ -391,6 +392,8 @@ class ChatBot:
                 logger.debug('Using processor function...')
                 try:
                     processed_response = question.processor(input_text=message, bot=self.bot)
+                    if isawaitable(processed_response):
+                        processed_response = await processed_response
                 except ValueError as e:
                     await self.chat_member.send(str(e))
                     return False
@@ -453,16 +456,18 @@ class ChatBot:
         for i, response in self.responses.items():
             column = self.script.questions[i].column
             response_map[column] = response.processed_response
-        try:
-            response_map_processed = await self.script.ending_processor(
-                responses=response_map,
-                bot=self.bot,
-                target_member=self.target_member
-            )
-        except ValueError as e:
-            raise ResponseError(e)
+        # Anything the ending processor writes is saved in the same commit as the responses
+        async with self.bot.db.transaction():
+            try:
+                response_map_processed = await self.script.ending_processor(
+                    responses=response_map,
+                    bot=self.bot,
+                    target_member=self.target_member
+                )
+            except ValueError as e:
+                raise ResponseError(e)
 
-        self.bot.db.add_row(self.script.table, response_map_processed)
+            await self.bot.db.aadd_row(self.script.table, response_map_processed)
 
 
 class ChatBotManager(commands.Cog, guild_ids=guild_id_list):
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from inspect import isawaitable
 from typing import TYPE_CHECKING
 
 import discord
@@ -57,8 +58,10 @@ class ChatbotModal(discord.ui.Modal):
 
             if question.processor:
                 try:
-                    self.chatbot.responses[i].processed_response = question.processor(input_text=raw_responses[i],
-                                                                                      bot=self.chatbot.bot)
+                    processed_response = question.processor(input_text=raw_responses[i], bot=self.chatbot.bot)
+                    if isawaitable(processed_response):
+                        processed_response = await processed_response
+                    self.chatbot.responses[i].processed_response = processed_response
                 except ValueError as e:
                     errors.append(str(e))
                     any_error = True
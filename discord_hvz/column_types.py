@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional, Union
+
+from sqlalchemy import Integer
+from sqlalchemy.types import TypeDecorator
+
+from discord_hvz.config import config
+
+
+class Timestamp(TypeDecorator):
+    """
+    A point in time stored as whole seconds since the Unix epoch, in UTC.
+    Unlike DateTime, which SQLite stores as text, these compare and sort as integers, so a range search on an indexed
+    Timestamp column is an index range scan. Values are read back as datetimes in the config's time zone.
+    Datetimes without a time zone are taken to be in the config's time zone.
+    """
+    impl = Integer
+    cache_ok = True
+
+    @staticmethod
+    def to_epoch(value: Union[datetime, int, float, str, None]) -> Optional[int]:
+        """Converts a datetime, epoch number or ISO 8601 string to epoch seconds. Raises ValueError if it can't."""
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            raise ValueError(f'"{value}" is not a time.')
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, str):
+            value = value.strip()
+            if value.lstrip('-').isdigit():
+                return int(value)
+            value = datetime.fromisoformat(value)
+        if not isinstance(value, datetime):
+            raise ValueError(f'"{value}" is not a time.')
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=config.time_zone)
+        return int(value.timestamp())
+
+    def process_bind_param(self, value, dialect) -> Optional[int]:
+        return self.to_epoch(value)
+
+    def process_result_value(self, value, dialect) -> Optional[datetime]:
+        if value is None:
+            return None
+        # Text is possible when reading another game's older DateTime column with this type
+        return datetime.fromtimestamp(self.to_epoch(value), tz=config.time_zone)
@@ -8,8 +8,9 @@ from discord.commands import context
 from discord.ext import commands
 from loguru import logger
 
-from .utilities import generate_tag_tree, respond_paginated
-from .config import config
+from .utilities import generate_tag_tree, respond_paginated, respond_paginated_rows
+from .config import config, ConfigError
+from .games import load_game_paths
 
 if TYPE_CHECKING:
     from main import HVZBot
@@ -28,6 +29,14 @@ guild_id_list = [config['server_id']]
 CONFIG_CHOICES = ['registration', 'tag_logging', 'silent_oz', 'google_sheet_export']
 
 
+def game_names(ctx: discord.AutocompleteContext):
+    # Read as the command is typed, so games added to the config while the bot runs are offered
+    try:
+        return list(load_game_paths(reload=True))
+    except ConfigError:
+        return []
+
+
 def setup(bot):  # this is called by Pycord to setup the cog
     bot.add_cog(AdminCommandsCog(bot))  # add the cog to the bot
 
@@ -39,6 +48,7 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
 
     member_group = SlashCommandGroup("member", "Commands for dealing with members.", guild_ids=guild_id_list)
     tag_group = SlashCommandGroup("tag", "Commands for dealing with tags.", guild_ids=guild_id_list)
+    game_group = SlashCommandGroup("game", "Commands for switching between games.", guild_ids=guild_id_list)
 
     @member_group.command(name='delete')
     async def member_delete(
@@ -76,11 +86,11 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
             await ctx.respond('No member or ID provided: nothing deleted.')
             return
         try:
-            member_row = bot.db.get_member(member_id)
+            member_row = await bot.db.aget_member(member_id)
         except ValueError:
             await ctx.respond('That member is not in the database as a player, and so there is nothing to delete.')
             return
-        bot.db.delete_row('members', 'id', str(member_id))
+        await bot.db.adelete_row('members', 'id', str(member_id))
 
         if member:
             await member.remove_roles(bot.roles['human'])
@@ -114,14 +124,14 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         """
         bot = self.bot
         try:
-            member_row = bot.db.get_member(member)
+            member_row = await bot.db.aget_member(member)
         except ValueError as e:
             await ctx.respond('This user is not in the database. They probably aren\'t registered.')
             logger.warning(e)
             return
 
         original_value = member_row[attribute]
-        bot.db.edit_row('members', 'id', member_row.id, attribute, value)
+        await bot.db.aedit_row('members', 'id', member_row.id, attribute, value)
         await ctx.respond(
             f'The value of {attribute} for <@{member_row.id}> was changed from \"{original_value}\"" to \"{value}\"')
         # bot.sheets_interface.export_to_sheet('members')
@@ -133,17 +143,14 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
 
         """
 
-        members = self.bot.db.get_table('members')
-        if not members:
-            await ctx.respond(f'No members found.')
-            return
         # TODO: Reconcile the fact that this function requires an email cell
-        message = ''
-        for member in members:
-            sub_string = f'<@!{member.id}>\t{member.name}\t{member.email}\n'
-            message += sub_string
-
-        await respond_paginated(ctx, message)
+        found = await respond_paginated_rows(
+            ctx, self.bot.db, 'members',
+            format_row=lambda member: f'<@!{member.id}>\t{member.name}\t{member.email}\n',
+            columns=['id', 'name', 'email']
+        )
+        if not found:
+            await ctx.respond(f'No members found.')
 
     @member_group.command(name='register')
     async def member_register(
@@ -160,7 +167,7 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         """
         bot = self.bot
         try:
-            bot.db.get_member(member)
+            await bot.db.aget_member(member)
             await ctx.respond(f'<@{member.id}> is already registered.')
             return
         except ValueError:
@@ -209,27 +216,39 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         human if there aren't any remaining tags on them.
         """
         bot = self.bot
-        tag_row = bot.db.get_tag(tag_id)
-        bot.db.delete_row('tags', 'tag_id', tag_id)
+        tag_row = await bot.db.aget_tag(tag_id)
+        async with bot.db.transaction():
+            await bot.db.adelete_row('tags', 'tag_id', tag_id)
+            existing_tag = await self._untag_member(tag_row)
         msg = ''
         # TODO: This might use optional column values. At least need to think about it.
         tagged_member = bot.guild.get_member(int(tag_row.tagged_id))
         if tagged_member is None:
             msg += f'Roles not changed since <@{tag_row.tagged_id}> ({tag_row.tagged_name}) is no longer on the server.'
+        elif existing_tag is not None:
+            msg += (f'Left <@{tagged_member.id}> as zombie because <@{existing_tag.tagger_id}> '
+                    f'({existing_tag.tagger_name}) still tagged them in tag {existing_tag.tag_id}')
         else:
-            try:
-                existing_tag = bot.db.get_tag(tag_row.tagged_id, column='tagged_id', filter_revoked=True)
-                # Change to human if there are no previous tags on the tagged member
-                msg += (f'Left <@{tagged_member.id}> as zombie because <@{existing_tag.tagger_id}> '
-                        f'({existing_tag.tagger_name}) still tagged them in tag {existing_tag.tag_id}')
-            except ValueError:
-                await tagged_member.add_roles(bot.roles['human'])
-                await tagged_member.remove_roles(bot.roles['zombie'])
-                msg += f'Changed <@{tagged_member.id}> to human.'
+            await tagged_member.add_roles(bot.roles['human'])
+            await tagged_member.remove_roles(bot.roles['zombie'])
+            msg += f'Changed <@{tagged_member.id}> to human.'
 
         msg = f'Tag {tag_id} deleted. ' + msg
         await ctx.respond(msg)
 
+    async def _untag_member(self, tag_row):
+        """
+        Called in a transaction after a tag is deleted or revoked. Returns another unrevoked tag on the same member if
+        there is one, since they are still a zombie. Otherwise, sets the member's faction to human and returns None.
+        """
+        db = self.bot.db
+        try:
+            return await db.aget_tag(tag_row.tagged_id, column='tagged_id', filter_revoked=True)
+        except ValueError:
+            # The member may have been deleted from the game, so this doesn't require a matching row
+            await db.aedit_rows('members', 'id', {tag_row.tagged_id: {'faction': 'human'}})
+            return None
+
     @tag_group.command(name='edit')
     async def tag_edit(
             self,
@@ -247,10 +266,10 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         There is no validation to check if the value you provide will work, so be careful!
         """
         bot = self.bot
-        tag_row = bot.db.get_tag(tag_id)
+        tag_row = await bot.db.aget_tag(tag_id)
 
         original_value = tag_row[attribute]
-        bot.db.edit_row('tags', 'tag_id', tag_row.tag_id, attribute, value)
+        await bot.db.aedit_row('tags', 'tag_id', tag_row.tag_id, attribute, value)
         await ctx.respond(
             f'The value of {attribute} for tag {tag_row.tag_id} was changed from \"{original_value}\"" to \"{value}\"')
 
@@ -269,25 +288,24 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         tag that makes them a zombie.
         """
         bot = self.bot
-        tag_row = bot.db.get_tag(tag_id)
+        tag_row = await bot.db.aget_tag(tag_id)
 
-        bot.db.edit_row('tags', 'tag_id', tag_id, 'revoked_tag', True)
+        async with bot.db.transaction():
+            await bot.db.aedit_row('tags', 'tag_id', tag_id, 'revoked_tag', True)
+            existing_tag = await self._untag_member(tag_row)
 
         msg = ''
 
         tagged_member = bot.guild.get_member(int(tag_row.tagged_id))
         if tagged_member is None:
             msg += f'Roles not changed since <@{tag_row.tagged_id}> ({tag_row.tagged_name}) is no longer on the server.'
+        elif existing_tag is not None:
+            msg += (f'Left <@{tagged_member.id}> as zombie because <@{existing_tag.tagger_id}> '
+                    f'({existing_tag.tagger_name}) still tagged them in tag {existing_tag.tag_id}')
         else:
-            try:
-                existing_tag = bot.db.get_tag(tag_row.tagged_id, column='tagged_id', filter_revoked=True)
-                # Change to human if there are no previous tags on the tagged member
-                msg += (f'Left <@{tagged_member.id}> as zombie because <@{existing_tag.tagger_id}> '
-                        f'({existing_tag.tagger_name}) still tagged them in tag {existing_tag.tag_id}')
-            except ValueError:
-                await tagged_member.add_roles(bot.roles['human'])
-                await tagged_member.remove_roles(bot.roles['zombie'])
-                msg += f'Changed <@{tagged_member.id}> to human.'
+            await tagged_member.add_roles(bot.roles['human'])
+            await tagged_member.remove_roles(bot.roles['zombie'])
+            msg += f'Changed <@{tagged_member.id}> to human.'
 
         msg = f'Tag {tag_id} revoked. ' + msg
         await ctx.respond(msg)
@@ -306,9 +324,11 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         Restores the tagged member to zombie.
         """
         bot = self.bot
-        tag_row = bot.db.get_tag(tag_id)
+        tag_row = await bot.db.aget_tag(tag_id)
 
-        bot.db.edit_row('tags', 'tag_id', tag_id, 'revoked_tag', False)
+        async with bot.db.transaction():
+            await bot.db.aedit_row('tags', 'tag_id', tag_id, 'revoked_tag', False)
+            await bot.db.aedit_rows('members', 'id', {tag_row.tagged_id: {'faction': 'zombie'}})
 
         msg = ''
 
@@ -366,7 +386,7 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         """
         bot = self.bot
         try:
-            tag_code = bot.db.get_member(ctx.author).tag_code
+            tag_code = (await bot.db.aget_member(ctx.author)).tag_code
             await ctx.respond(f'Your tag code is: {tag_code}\nHave this ready to give to a zombie who tags you.',
                               ephemeral=True)
         except ValueError:
@@ -383,7 +403,7 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         """
         bot = self.bot
         await ctx.response.defer()
-        tree = generate_tag_tree(bot.db, bot)
+        tree = await bot.db.arun(generate_tag_tree, bot.db, bot)
         if tree == '':
             tree = 'There are no tags yet! Try again when there are.'
         tree = '**THE ZOMBIE FAMILY TREE\n**' + tree
@@ -392,6 +412,38 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
 
 
 
+    @slash_command(name='database_stats')
+    async def database_stats(
+            self,
+            ctx: context.ApplicationContext,
+            reset: Option(bool, 'Clears the numbers after showing them.', required=False, default=False)
+    ):
+        """
+        Shows how often each kind of database query ran and how long it took, slowest in total first.
+
+        """
+        query_stats = self.bot.db.query_stats
+        statements = query_stats.summary()
+        if not statements:
+            await ctx.respond('No database queries have run yet.')
+            return
+
+        message = (
+            f'**Database queries since <t:{int(query_stats.since)}:f>**\n'
+            f'Queries over {query_stats.slow_query_ms:g} ms are logged as slow.\n'
+            f'count | total ms | mean ms | p95 ms | max ms\n'
+        )
+        for stats in statements:
+            statement = stats.statement if len(stats.statement) <= 300 else stats.statement[:300] + '...'
+            message += (
+                f'\n**{stats.count}** | {stats.total_ms:.1f} | {stats.mean_ms:.2f} | {stats.percentile_ms(95):g} | '
+                f'{stats.max_ms:.1f}\n`{statement}`\n'
+            )
+        if reset:
+            query_stats.reset()
+
+        await respond_paginated(ctx, message)
+
     @slash_command(name='shutdown', description='Shuts down the bot.')
     async def shutdown(
             self,
@@ -443,7 +495,7 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         """
         bot = self.bot
         try:
-            member_row = bot.db.get_member(member)
+            member_row = await bot.db.aget_member(member)
         except ValueError as e:
             await ctx.respond('This user is not in the database. They probably aren\'t registered.')
             logger.warning(e)
@@ -453,7 +505,7 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
             await ctx.respond(
                 f'{member_row.name}\'s OZ status is {member_row.oz}. Give a True or False argument to change their setting.')
             return
-        bot.db.edit_row('members', 'id', member_row.id, 'oz', setting)
+        await bot.db.aedit_row('members', 'id', member_row.id, 'oz', setting)
 
         await ctx.respond(f'Changed <@{member_row.id}>\'s OZ status to {setting}')
 
@@ -470,3 +522,55 @@ class AdminCommandsCog(commands.Cog, guild_ids=guild_id_list):
         except Exception as e:
             await ctx.respond('Could not change permissions in the channels. Please give the bot permission to.')
             logger.warning(e)
+
+    @game_group.command(name='list')
+    async def game_list(self, ctx):
+        """
+        Lists the games, with how many members and tags each has.
+        """
+        db = self.bot.db
+        member_counts = await db.acount_rows_all_games('members')
+        tag_counts = await db.acount_rows_all_games('tags')
+        lines = []
+        for game, path in db.games.items():
+            line = f'**{game}** (`{path.name}`): {member_counts.get(game, 0)} members, {tag_counts.get(game, 0)} tags'
+            if game == db.active_game:
+                line += ' *(active)*'
+            lines.append(line)
+        await ctx.respond('\n'.join(lines))
+
+    @game_group.command(name='switch')
+    async def game_switch(
+            self,
+            ctx,
+            game: Option(str, 'The game to make active.', autocomplete=discord.utils.basic_autocomplete(game_names))
+    ):
+        """
+        Makes another game the active one, without restarting the bot.
+
+        Registrations, tags and everything else then use that game's database file.
+        Roles on the server are not changed, so update them to match the game.
+        The choice is saved to 'active_game' in the config, so it lasts through restarts.
+        """
+        db = self.bot.db
+        if game == db.active_game:
+            await ctx.respond(f'"{game}" is already the active game.')
+            return
+        try:
+            # Games added to 'database_games' since the bot started can be switched to as well
+            db.games = load_game_paths(reload=True)
+        except ConfigError as e:
+            await ctx.respond(str(e))
+            return
+        await ctx.response.defer()
+        try:
+            await db.aswitch_game(game)
+        except ValueError as e:
+            await ctx.respond(str(e))
+            return
+        except Exception as e:
+            logger.exception(e)
+            await ctx.respond(f'Could not switch to "{game}", so "{db.active_game}" is still active: {e}')
+            return
+        config['active_game'] = game
+        await ctx.respond(f'Switched the active game to "{game}".')
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import sys
-from typing import Dict, List
+from typing import Dict, List, Any
 from ruamel.yaml import YAML
 from datetime import datetime, timedelta, timezone
 from dateutil import tz
@@ -83,6 +83,20 @@ class HVZConfig:
         with open(self.filepath, mode='w') as fp:
             yaml.dump(self._config, fp)
 
+    def reload(self, key):
+        """
+        Reads one option from the file again, so edits made while the bot runs are seen, and returns its new value.
+        The option is kept in memory too, so the next commit() doesn't overwrite the edit.
+        """
+        with open(self.filepath) as fp:
+            on_disk = yaml.load(fp)
+        try:
+            self._config[key] = on_disk[key]
+        except KeyError as e:
+            raise ConfigError(
+                f'Looked for the config option {e} in {self.filepath.name} but didn\'t find it. Perhaps there is a typo in your configuration?') from e
+        return self._config[key]
+
     def __getitem__(self, item):
         try:
             return self._config[item]
@@ -90,10 +104,29 @@ class HVZConfig:
             raise ConfigError(
                 f'Looked for the config option {e} in {self.filepath.name} but didn\'t find it. Perhaps there is a typo in your configuration?') from e
 
+    def get(self, key, default=None):
+        """Returns an optional config option, or default if the option is missing or left empty."""
+        value = self._config.get(key)
+        return default if value is None else value
+
+    def section(self, name: str, defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the settings in an optional config section, such as 'database_backup'. defaults fills in the section if
+        it is missing, and any setting missing from it. Settings that aren't in defaults are ignored with a warning.
+        """
+        settings = dict(defaults)
+        for key, value in (self.get(name) or {}).items():
+            key = str(key).casefold()
+            if key not in defaults:
+                logger.warning(f'Ignoring the unknown setting "{key}" in "{name}" in {self.filepath.name}.')
+                continue
+            settings[key] = value
+        return settings
+
     def __setitem__(self, key, value):
         try:
             self._config[key]
-        except ConfigError:
+        except KeyError:
             logger.warning(
                 f'Adding the new config option "{key}" with the value "{value}" to {self.filepath}. Was this intended?')
         self._config[key] = value
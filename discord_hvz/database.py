@@ -1,21 +1,37 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import copy
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import List, Union, Dict, TYPE_CHECKING, ClassVar
+from typing import List, Union, Dict, TYPE_CHECKING, ClassVar, Callable, Any, Iterator, Optional
 
 import discord
 import sqlalchemy
 from loguru import logger
-from sqlalchemy import Table, Column, Integer, String, DateTime, Boolean
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy import select, delete, update
+from sqlalchemy import Table, Column, Integer, String, DateTime, Boolean, Index
+from sqlalchemy import create_engine, MetaData, event
+from sqlalchemy import select, delete, update, bindparam, true, func, literal, null, type_coerce, union_all
 from sqlalchemy.engine import Row
-from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.exc import NoSuchTableError, OperationalError
+from sqlalchemy.pool import StaticPool, QueuePool
 
 from discord_hvz.sheets import SheetsInterface
-from discord_hvz.config import config
+from discord_hvz.member_cache import MemberCache
+from discord_hvz.change_journal import ChangeJournal
+from discord_hvz.sheet_outbox import SheetOutbox
+from discord_hvz.migrations import SchemaMigrator, get_user_version, get_schema_version, bump_user_version
+from discord_hvz.schema_cache import SchemaCache
+from discord_hvz.tag_codes import TagCodeAllocator
+from discord_hvz.query_stats import QueryStats, query_origin, describe_caller
+from discord_hvz.column_types import Timestamp
+from discord_hvz.games import load_game_paths, load_active_game, schema_name, MAX_ATTACHED_GAMES
+from discord_hvz.config import config, ConfigError
 
 # TODO: Make database name more human-friendly by default, and have it configurable
 
@@ -30,17 +46,246 @@ def dump(obj):
         except Exception:
             print('TYPE ERROR')
 
+# SQLite PRAGMAs set on every new database connection. Each can be overridden in the 'database_performance' config section.
+# WAL lets readers work during writes, and synchronous NORMAL skips most fsyncs while staying safe in WAL mode.
+DEFAULT_PERFORMANCE_PROFILE: Dict[str, Union[str, int]] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,  # 256 MiB
+    'cache_size': -16000,  # Negative values are in KiB, so this is about 16 MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # Milliseconds
+}
+
+
+# Used as a filepath to keep the database in memory, such as for tests and benchmarks. Nothing is written to disk.
+MEMORY_DATABASE = ':memory:'
+
+
+def load_performance_profile() -> Dict[str, Union[str, int]]:
+    """Returns the default SQLite PRAGMAs, updated with any set in the config."""
+    profile = config.section('database_performance', DEFAULT_PERFORMANCE_PROFILE)
+    for pragma, value in profile.items():
+        if not str(value).lstrip('-').isalnum():
+            raise ConfigError(f'The "database_performance" setting "{pragma}" has the invalid value "{value}".')
+    return profile
+
+
+# Connections each file engine keeps open, and how many more it may open for a moment when they are all in use
+DATABASE_POOL_SIZE = 2
+DATABASE_POOL_OVERFLOW = 4
+
+
+def create_database_engine(filepath: Path | str, profile: Dict[str, Union[str, int]] = None) -> sqlalchemy.engine.Engine:
+    """
+    Creates an engine for an SQLite database file, or for a database in memory if filepath is MEMORY_DATABASE.
+    Every connection it opens uses the performance profile. All engines in the project should be made with this.
+    """
+    if profile is None:
+        profile = load_performance_profile()
+    if str(filepath) == MEMORY_DATABASE:
+        # Every connection to :memory: is a new, empty database, so the engine keeps exactly one and shares it between threads
+        engine = create_engine(
+            'sqlite+pysqlite://', future=True, poolclass=StaticPool, connect_args={'check_same_thread': False}
+        )
+    else:
+        # SQLAlchemy would otherwise open a new connection for every statement, so the page cache and memory map of the
+        # profile would never warm up. Connections are kept instead, and the profile is applied once to each.
+        # The bot does its database work on one thread, so a couple of connections is enough.
+        engine = create_engine(
+            f"sqlite+pysqlite:///{str(filepath)}", future=True, poolclass=QueuePool,
+            pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_POOL_OVERFLOW,
+            connect_args={'check_same_thread': False}
+        )
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in profile.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+        cursor.close()
+
+    return engine
+
+
+# The tables of the default config.yml, used by HvzDb.in_memory() so tests don't depend on the config
+DEFAULT_DATABASE_TABLES: Dict[str, Dict[str, str]] = {
+    'members': {
+        'id': 'String',
+        'name': 'String',
+        'nickname': 'String',
+        'discord_name': 'String',
+        'cpo': 'String',
+        'faction': 'String',
+        'tag_code': 'String',
+        'oz_desire': 'String',
+        'email': 'String',
+        'want_bandana': 'String',
+        'registration_time': 'Timestamp',
+        'oz': 'Boolean'
+    },
+    'tags': {
+        'tag_id': 'incrementing_integer',
+        'tagger_id': 'String',
+        'tagger_name': 'String',
+        'tagger_nickname': 'String',
+        'tagger_discord_name': 'String',
+        'tagged_id': 'String',
+        'tagged_name': 'String',
+        'tagged_nickname': 'String',
+        'tagged_discord_name': 'String',
+        'tag_time': 'Timestamp',
+        'report_time': 'Timestamp',
+        'revoked_tag': 'String'
+    }
+}
+DEFAULT_DATABASE_INDEXES: Dict[str, List[str]] = {
+    'members': ['registration_time'],
+    'tags': ['tagged_id', 'tag_time']
+}
+
+
+# The transaction opened by HvzDb.transaction() in the current thread or asyncio task, if there is one
+_current_transaction: ContextVar[Optional[DbTransaction]] = ContextVar('current_transaction', default=None)
+
+
+class DbTransaction:
+    """
+    A unit of work on the database, made by HvzDb.transaction(). All HvzDb reads and writes inside it share one
+    connection and commit together when it exits, or roll back together if an exception escapes.
+    The Google Sheet is notified once per changed table when it commits, rather than once per write.
+
+    Use "with" in synchronous code and "async with" in coroutines. Transactions opened inside another one simply join it.
+    An async transaction only opens on its first awaited database call. From then until it exits, other database work
+    from the bot waits for it, so do any slow Discord calls before the first database call where possible.
+    Inside an async transaction, use only the awaitable database methods.
+    """
+
+    def __init__(self, db: HvzDb):
+        self.db = db
+        self.connection: Optional[sqlalchemy.engine.Connection] = None
+        self.changed_tables: Dict[str, None] = {}  # Used as an ordered set
+        self._transaction: Optional[sqlalchemy.engine.Transaction] = None
+        self._token: Optional[contextvars.Token] = None
+        self._joined = False
+        self._starting: Optional[asyncio.Task] = None
+
+    def _begin(self) -> None:
+        self.connection = self.db.engine.connect()
+        self._transaction = self.connection.begin()
+
+    def _finish(self, commit: bool) -> None:
+        try:
+            if commit:
+                self._transaction.commit()
+            else:
+                self._transaction.rollback()
+        finally:
+            self.connection.close()
+        if not commit and 'members' in self.changed_tables:
+            # The member cache was updated by writes that are now undone
+            with self.db.engine.connect() as conn:
+                self.db.member_cache.load(conn)
+
+    def _notify(self) -> None:
+        for table_name in self.changed_tables:
+            self.db._table_updated(table_name)
+
+    def __enter__(self) -> DbTransaction:
+        if _current_transaction.get() is not None:
+            self._joined = True
+            return _current_transaction.get()
+        self._begin()
+        self._token = _current_transaction.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if self._joined:
+            return False
+        _current_transaction.reset(self._token)
+        self._finish(commit=exc_type is None)
+        if exc_type is None:
+            self._notify()
+        return False
+
+    async def __aenter__(self) -> DbTransaction:
+        if _current_transaction.get() is not None:
+            self._joined = True
+            return _current_transaction.get()
+        self._token = _current_transaction.set(self)
+        return self
+
+    async def start(self) -> None:
+        """Opens the transaction's connection. HvzDb.arun() calls this before the first database work inside it."""
+        if self._starting is None:
+            self._starting = asyncio.create_task(self._start())
+        await self._starting
+
+    async def _start(self) -> None:
+        await self.db.transaction_lock.acquire()
+        try:
+            await self.db._run_on_db_thread(self._begin)
+        except BaseException:
+            self.db.transaction_lock.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> bool:
+        if self._joined:
+            return False
+        _current_transaction.reset(self._token)
+        if self._starting is None:
+            return False  # No database work was done
+        await self._starting
+        try:
+            await self.db._run_on_db_thread(self._finish, exc_type is None)
+        finally:
+            self.db.transaction_lock.release()
+        if exc_type is None:
+            self._notify()
+        return False
+
+
 @dataclass
 class HvzDb:
     engine: sqlalchemy.engine.Engine = field(init=False)
     metadata_obj: MetaData = field(init=False, default_factory=MetaData)
     tables: Dict[str, Table] = field(init=False, default_factory=dict)
     sheet_interface: SheetsInterface = field(init=False, default=None)
-    filepath: Path = config.db_path
-    database_config: Dict[str, Dict[str, str]] = field(init=False, default_factory=dict)
+    member_cache: MemberCache = field(init=False, default=None)
+    journal: ChangeJournal = field(init=False, default=None)
+    tag_codes: TagCodeAllocator = field(init=False, default=None)
+    query_stats: QueryStats = field(init=False, default=None)
+    migrator: SchemaMigrator = field(init=False, default=None)
+    schema_cache: SchemaCache = field(init=False, default=None)
+    # A database file, or MEMORY_DATABASE. HvzDb.in_memory() is the easiest way to make an in-memory database.
+    filepath: Path | str = config.db_path
+    # Whether to export to the Google Sheet. None follows 'google_sheet_export' in the config
+    sheet_export: Optional[bool] = None
+    # The game whose file is opened. None follows 'active_game' in the config
+    active_game: Optional[str] = None
+    # Every game's database file, by name. The other games are attached to a connection when it first reads them.
+    games: Dict[str, Path] = field(init=False, default_factory=dict)
+    # The tables and indexes to create. None follows 'database_tables' and 'database_indexes' in the config
+    database_config: Optional[Dict[str, Dict[str, str]]] = None
+    index_config: Optional[Dict[str, List[str]]] = None
+    # All awaitable methods run on this single thread, so the event loop never waits on SQLite
+    executor: ThreadPoolExecutor = field(init=False, default=None)
+    _loop: asyncio.AbstractEventLoop = field(init=False, default=None, repr=False)
+    _transaction_lock: asyncio.Lock = field(init=False, default=None, repr=False)
+    # Tables and indexes waiting for create_tables(), so they are all made in one go
+    _pending_tables: Dict[str, Dict[str, Union[str, type]]] = field(init=False, default_factory=dict, repr=False)
+    _pending_indexes: Dict[str, List[str]] = field(init=False, default_factory=dict, repr=False)
+    _schema_key: tuple = field(init=False, default=None, repr=False)
+    _schema_reflected: bool = field(init=False, default=False, repr=False)
+    # What each cog asked prepare_table() for, so the tables can be prepared again after switching games
+    _prepared_tables: Dict[str, tuple] = field(init=False, default_factory=dict, repr=False)
+    # Tables of the other games, reflected from their attached databases when first read
+    _game_tables: Dict[tuple, Optional[Table]] = field(init=False, default_factory=dict, repr=False)
 
     # Table names that cannot be created in the config. Reserved for cogs / modules
-    reserved_table_names: ClassVar[List[str]] = ['persistent_panels']
+    reserved_table_names: ClassVar[List[str]] = [
+        'persistent_panels', ChangeJournal.table_name, SchemaMigrator.table_name, SheetOutbox.table_name
+    ]
 
     required_columns: ClassVar[Dict[str, Dict[str, str]]] = {
         'members': {
@@ -57,79 +302,317 @@ class HvzDb:
         }
     }
 
+    # Columns that are always indexed, since the bot searches them constantly. More can be added in the config.
+    required_indexes: ClassVar[Dict[str, List[str]]] = {
+        'members': ['id', 'tag_code'],
+        'tags': ['tagger_id']
+    }
+
+    # Required indexes that also enforce that no two rows share a value
+    unique_indexes: ClassVar[Dict[str, List[str]]] = {
+        'members': ['tag_code']
+    }
+
+    aggregate_functions: ClassVar[Dict[str, Callable]] = {
+        'count': func.count,
+        'sum': func.sum,
+        'min': func.min,
+        'max': func.max
+    }
+
     valid_column_types: ClassVar[Dict[str, type]] = {
         'string': String,
         'integer': Integer,
         'incrementing_integer': Integer,
         'boolean': Boolean,
-        'datetime': DateTime
+        'datetime': DateTime,
+        'timestamp': Timestamp
     }
 
     
     def __post_init__(self):
         # TODO: Need to make sure the required tables are always created. Might be config-depended now...
-        self.database_config: Dict[str, Dict[str, str]] = copy.deepcopy(config['database_tables'])
-        self.engine = create_engine(f"sqlite+pysqlite:///{str(self.filepath)}", future=True)
-
-        if not self.filepath.exists():
-            logger.warning(
-                f"No database found at the path specified by 'database_path' in {config.filepath.name}. It will be created at {self.filepath} \n"
-                "Now creating the needed tables..."
-            )
-
-        for table_name, column_dict in self.database_config.items():
+        if self.database_config is None:
+            self.database_config = copy.deepcopy(config['database_tables'])
+        if self.index_config is None:
             try:
-                self.tables[table_name] = Table(table_name, self.metadata_obj, autoload_with=self.engine)
-                continue
-            except NoSuchTableError: pass
-            logger.warning(f'Found a table called "{table_name}" in the config, but not in the database. Creating the table.')
+                self.index_config = copy.deepcopy(config['database_indexes']) or {}
+            except ConfigError:
+                # Older configs have no index section. The required indexes are still created.
+                self.index_config = {}
+        if self.is_in_memory:
+            self.games = {'memory': self.filepath}
+            self.active_game = 'memory'
+        else:
+            # Scripts and tests may give the path as a string
+            self.filepath = Path(self.filepath)
+            if self.filepath == config.db_path:
+                self.games = load_game_paths()
+                self.active_game = self.active_game or load_active_game(self.games)
+                self.filepath = self.games[self.active_game]
+            else:
+                # A database opened by path, such as by a script, is a game of its own
+                self.games = {self.filepath.stem: self.filepath}
+                self.active_game = self.filepath.stem
+        self.query_stats = QueryStats()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hvzdb')
 
+        self._open()
 
-            column_args = []
-            # Add any required columns that are missing
+        if self.sheet_export is None:
+            self.sheet_export = config['google_sheet_export'] == True
+        if self.sheet_export:
+            self.sheet_interface = SheetsInterface(self)
 
+    @classmethod
+    def in_memory(cls, database_config: Dict[str, Dict[str, str]] = None, index_config: Dict[str, List[str]] = None,
+                  **kwargs) -> HvzDb:
+        """
+        Returns an HvzDb kept entirely in memory, with its tables created. Nothing touches the disk, so test suites and
+        benchmarks run fast, and any number can run at once. The tables default to DEFAULT_DATABASE_TABLES rather than
+        the config's, so the result doesn't depend on config.yml. Cogs' tables can be added with prepare_table() and
+        create_tables() as usual.
+        Everything runs on one shared connection, so don't use the synchronous methods while awaitable ones are running.
+        """
+        return cls(
+            filepath=MEMORY_DATABASE,
+            database_config=copy.deepcopy(DEFAULT_DATABASE_TABLES if database_config is None else database_config),
+            index_config=copy.deepcopy(DEFAULT_DATABASE_INDEXES if index_config is None else index_config),
+            sheet_export=kwargs.pop('sheet_export', False),
+            **kwargs
+        )
 
-            # Create Columns from the config
-            for column_name, type_string in column_dict.items():
-                column_args.append(self._create_column_object(column_name, type_string))
+    @property
+    def is_in_memory(self) -> bool:
+        return str(self.filepath) == MEMORY_DATABASE
 
-            if table_name in self.required_columns:
-                required_columns_table = self.required_columns[table_name]
-                for column_name, type_string in required_columns_table.items():
-                    if column_name in column_dict:
-                        continue
-                    column_args.append(self._create_column_object(column_name, type_string))
-                    logger.warning(f'The required column "{column_name}" was not found in the config for the table "{table_name}". Creating it.')
+    def _open(self) -> None:
+        """Opens the active game's database file, migrating and creating the config's tables."""
+        self.engine = create_database_engine(self.filepath)
+        self.query_stats.install(self.engine)
 
-            self.tables[table_name] = Table(table_name.casefold(), self.metadata_obj, *column_args)
+        if not self.is_in_memory and not self.filepath.exists():
+            logger.warning(
+                f"No database found at the path specified by 'database_path' in {config.filepath.name}. It will be created at {self.filepath} \n"
+                "Now creating the needed tables..."
+            )
 
-        self.metadata_obj.create_all(self.engine)
+        self.migrator = SchemaMigrator(self)
+        self.schema_cache = SchemaCache(None if self.is_in_memory else self.filepath.with_name(self.filepath.name + '.schema'))
+        with self.engine.connect() as conn:
+            self._schema_key = SchemaCache.make_key(
+                get_user_version(conn), get_schema_version(conn), self.migrator.hashes
+            )
+        cached_metadata = self.schema_cache.load(self._schema_key)
+        if cached_metadata is not None:
+            self.metadata_obj = cached_metadata
 
-        if config['google_sheet_export'] == True:
-            self.sheet_interface = SheetsInterface(self)
+        for table_name, column_dict in self.database_config.items():
+            # Add any required columns that are missing from the config
+            columns = dict(column_dict)
+            missing_columns = []
+            for column_name, type_string in self.required_columns.get(table_name, {}).items():
+                if column_name not in columns:
+                    columns[column_name] = type_string
+                    missing_columns.append(column_name)
+
+            index_columns = list(self.required_indexes.get(table_name, []))
+            index_columns.extend(self.index_config.get(table_name) or [])
+            self._pending_indexes[table_name] = index_columns
+
+            table = self._load_table(table_name)
+            if table is not None:
+                # Existing tables are altered to match the config, keeping their data
+                self.tables[table_name] = self.migrator.migrate(table, columns)
+                continue
+            logger.warning(f'Found a table called "{table_name}" in the config, but not in the database. Creating the table.')
+            for column_name in missing_columns:
+                logger.warning(f'The required column "{column_name}" was not found in the config for the table "{table_name}". Creating it.')
+            self._define_table(table_name, columns)
+
+        self.journal = ChangeJournal(self)
+        self.create_tables()
+        self.journal.prune()
+
+        # Only published once loaded, since the event loop may be reading the cache of the game being switched from
+        member_cache = MemberCache(self.tables['members'])
+        with self.engine.connect() as conn:
+            member_cache.load(conn)
+        self.member_cache = member_cache
+        self.tag_codes = TagCodeAllocator(self.member_cache)
+
+    def _attach_games(self, conn: sqlalchemy.engine.Connection) -> None:
+        """
+        Attaches the other games' databases to a connection, so one statement can read across games.
+        Only done before reading another game, and once per pooled connection, so other statements never pay for it.
+        SQLite can't attach a database in the middle of a write, so this must come before any writes on the connection.
+        """
+        # Kept with the pooled connection, so it lasts as long as the attachments do
+        attached = conn.connection.info.setdefault('attached_games', set())
+        for game, path in self.games.items():
+            if game == self.active_game or game in attached or not path.exists():
+                continue
+            if len(attached) >= MAX_ATTACHED_GAMES:
+                logger.warning(f'Only {MAX_ATTACHED_GAMES} other games can be read alongside the active game. Skipping "{game}".')
+                continue
+            cursor = conn.connection.cursor()
+            cursor.execute(f'ATTACH DATABASE ? AS "{schema_name(game)}"', (str(path),))
+            cursor.close()
+            attached.add(game)
 
-    def prepare_table(self, table_name: str, columns: Dict[str, Union[str, type]]) -> None:
+    def switch_game(self, game: str) -> None:
         """
-        Creates a new table in the database if there is none, and loads the table from the database if it exists already.
+        Makes another game the active one, reopening the database on its file without restarting the bot.
+        Tables that cogs prepared are prepared again on the new file. Must not be called inside a transaction.
         """
+        if game not in self.games:
+            raise ValueError(f'There is no game called "{game}". The games are: {", ".join(self.games)}')
+        if _current_transaction.get() is not None:
+            raise RuntimeError('Cannot switch games inside a transaction.')
+        if game == self.active_game:
+            return
+        previous_game = self.active_game
+        if self.sheet_interface is not None:
+            # The Sheet is about to show the new game, so this game's last export no longer matches it
+            self.sheet_interface.outbox.forget_snapshots()
+        self.engine.dispose()
+        self.active_game = game
+        self.filepath = self.games[game]
+        self.metadata_obj = MetaData()
+        self.tables = {}
+        self._pending_tables = {}
+        self._pending_indexes = {}
+        self._game_tables = {}
+        self._schema_reflected = False
         try:
-            self.tables[table_name] = Table(table_name, self.metadata_obj, autoload_with=self.engine)
-        except NoSuchTableError:
+            self._open()
+            for table_name, (columns, indexes) in self._prepared_tables.items():
+                if table_name not in self.tables:
+                    self.prepare_table(table_name, columns, indexes)
+            self.create_tables()
+        except Exception:
+            logger.exception(f'Could not switch to the game "{game}". Switching back to "{previous_game}".')
+            self.switch_game(previous_game)
+            raise
+        logger.info(f'Switched the active game to "{game}" at {self.filepath}.')
+        # The Google Sheet shows the active game
+        for table_name in self.database_config:
+            self._table_updated(table_name)
+
+    def prepare_table(self, table_name: str, columns: Dict[str, Union[str, type]], indexes: List[str] = None) -> None:
+        """
+        Creates a new table in the database if there is none, and loads the table from the database if it exists already.
+        An existing table is migrated to have the given columns. Any columns listed in indexes are indexed if they aren't already.
+        New tables and indexes are only created by the next call to create_tables(), which main() makes once every cog
+        has been loaded.
+        """
+        table = self._load_table(table_name)
+        if table is not None:
+            self.tables[table_name] = self.migrator.migrate(table, columns)
+        else:
             logger.warning(
                 f'Creating table "{table_name}" since it was not found in the database.')
+            self._define_table(table_name, columns)
 
-            column_args = []
-            # Create Columns from the config
-            for column_name, column_type in columns.items():
-                column_args.append(self._create_column_object(column_name, column_type))
+        self.tables[table_name].column_names = list(columns)
+        if indexes:
+            self._pending_indexes.setdefault(table_name, []).extend(indexes)
+        self._prepared_tables[table_name] = (columns, indexes)
 
-            self.tables[table_name] = Table(table_name.casefold(), self.metadata_obj, *column_args)
-
-        self.metadata_obj.create_all(self.engine)
-        self.tables[table_name].column_names = columns.keys()
+    def create_tables(self) -> None:
+        """
+        Creates every table and index asked for by prepare_table() since the last call, in one transaction,
+        then saves the schema cache if the schema changed.
+        """
+        with self.engine.begin() as conn:
+            changed = False
+            if self._pending_tables:
+                self.metadata_obj.create_all(conn, tables=[self.tables[name] for name in self._pending_tables])
+                changed = True
+            for table_name, column_names in self._pending_indexes.items():
+                unique_columns = self.unique_indexes.get(table_name, [])
+                changed = self._ensure_indexes(conn, table_name, column_names, unique_columns) or changed
+            if changed:
+                version = bump_user_version(conn)
+                self.migrator.record_created(conn, self._pending_tables, version)
+            else:
+                version = get_user_version(conn)
+            sqlite_schema_version = get_schema_version(conn)
+        self._pending_tables.clear()
+        self._pending_indexes.clear()
+
+        schema_key = SchemaCache.make_key(version, sqlite_schema_version, self.migrator.hashes)
+        if schema_key != self._schema_key or self._schema_reflected:
+            self.schema_cache.save(schema_key, self.metadata_obj)
+            self._schema_key = schema_key
+            self._schema_reflected = False
+
+    def _load_table(self, table_name: str) -> Optional[Table]:
+        """
+        Returns the table from the schema cache, or reflects it from the database if it isn't cached.
+        Returns None if the table doesn't exist.
+        """
+        table = self.metadata_obj.tables.get(table_name)
+        if table is not None:
+            return table
+        try:
+            table = Table(table_name, self.metadata_obj, autoload_with=self.engine)
+        except NoSuchTableError:
+            return None
+        self._schema_reflected = True
+        return table
+
+    def _define_table(self, table_name: str, columns: Dict[str, Union[str, type]]) -> None:
+        # Create Columns from the config. The table itself is made by create_tables()
+        column_args = [self._create_column_object(column_name, column_type) for column_name, column_type in columns.items()]
+        self.tables[table_name] = Table(table_name.casefold(), self.metadata_obj, *column_args)
+        self._pending_tables[table_name] = columns
+
+    def _ensure_indexes(self, conn: sqlalchemy.engine.Connection, table_name: str, column_names: List[str],
+                        unique_columns: List[str] = ()) -> bool:
+        """
+        Creates a single-column index on each of the given columns, unless the column already has one.
+        Indexes on unique_columns are made UNIQUE, replacing an existing non-unique index if the data allows it.
+        Returns True if any were created.
+        """
+        created = False
+        table = self.tables[table_name]
+        unique_columns = {column_name.casefold() for column_name in unique_columns}
+        existing_indexes = {tuple(column.name for column in index.columns): index for index in table.indexes}
+        for column_name in dict.fromkeys([*column_names, *unique_columns]):
+            column_name = column_name.casefold()
+            if column_name not in table.c:
+                logger.warning(f'Cannot index the column "{column_name}" because it is not in the table "{table_name}".')
+                continue
+            unique = column_name in unique_columns
+            existing_index = existing_indexes.get((column_name,))
+            if existing_index is not None:
+                if existing_index.unique or not unique:
+                    continue
+                if self._has_duplicates(conn, table.c[column_name]):
+                    logger.warning(
+                        f'Cannot make the index on the column "{column_name}" of the table "{table_name}" unique, '
+                        f'because some rows share a value. Fix the duplicates and restart the bot.'
+                    )
+                    continue
+                existing_index.drop(bind=conn)
+                table.indexes.discard(existing_index)
+            index = Index(f'ix_{table.name}_{column_name}', table.c[column_name], unique=unique)
+            index.create(bind=conn, checkfirst=True)
+            existing_indexes[(column_name,)] = index
+            created = True
+            logger.info(f'Created {"a unique" if unique else "an"} index on the column "{column_name}" of the table "{table_name}".')
+        return created
+
+    @staticmethod
+    def _has_duplicates(conn: sqlalchemy.engine.Connection, column: Column) -> bool:
+        selection = select(column).where(column.is_not(None)).group_by(column).having(func.count() > 1).limit(1)
+        return conn.execute(selection).first() is not None
 
     def delete_table(self, table_name: str):
-        self.tables[table_name].drop(bind=self.engine)
+        with self.engine.begin() as conn:
+            self.tables[table_name].drop(bind=conn)
+            bump_user_version(conn)
         logger.warning(f'Deleted table named {table_name}')
 
     def _validate_table_selection(self, table: str | Table) -> Table:
@@ -167,13 +650,52 @@ class HvzDb:
         try:
             if isinstance(table, Table): table_name = table.name
             else: table_name = table
+            transaction = _current_transaction.get()
+            if transaction is not None:
+                # Held until the transaction commits, so each table is only sent once
+                transaction.changed_tables[table_name] = None
+                return
+            if self.sheet_interface is None:
+                return
             if table_name in self.database_config: # Only send to Sheets if the table is in config.yml
-                self.sheet_interface.update_table(table_name)
+                if self._loop is not None and not self._loop.is_closed():
+                    # Writes may happen on the database thread, but the Sheet export is scheduled on the event loop
+                    self._loop.call_soon_threadsafe(self.sheet_interface.update_table, table_name)
+                else:
+                    self.sheet_interface.update_table(table_name)
         except Exception as e:
             # Allow sheet failure to silently pass for the user.
             logger.exception(f'The database failed to update to the Google Sheet with this error: {e}')
 
 
+    def transaction(self) -> DbTransaction:
+        """
+        Groups database work into one atomic commit. Use as "with db.transaction():" or "async with db.transaction():"
+        """
+        return DbTransaction(self)
+
+    @property
+    def transaction_lock(self) -> asyncio.Lock:
+        # Made on first use so that it belongs to the running event loop
+        if self._transaction_lock is None:
+            self._transaction_lock = asyncio.Lock()
+        return self._transaction_lock
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlalchemy.engine.Connection]:
+        """
+        Yields the connection of the current transaction if there is one.
+        Otherwise, yields a new connection that commits when the block exits.
+        """
+        transaction = _current_transaction.get()
+        if transaction is not None:
+            if transaction.connection is None:
+                raise RuntimeError('Only the awaitable database methods can be used inside an async transaction.')
+            yield transaction.connection
+        else:
+            with self.engine.begin() as conn:
+                yield conn
+
     def _create_column_object(self, column_name: str, column_type: Union[str, type]) -> Column:
         """
         Returns a Column object after forcing the name to lowercase and validating the type
@@ -218,8 +740,16 @@ class HvzDb:
         for k, i in input_row.items():
             row[k.casefold()] = i
 
-        with self.engine.begin() as conn:
+        with self._connect() as conn:
             result = conn.execute(table.insert().values(row))
+            key_column = self._key_column(table)
+            if key_column is None:
+                key = None
+            elif key_column.primary_key:
+                key = result.inserted_primary_key[0]
+            else:
+                key = row.get(key_column.name)
+            self._record_write(conn, table, 'insert', [key], row.keys())
             self._table_updated(table)
             return result
 
@@ -233,19 +763,53 @@ class HvzDb:
         Returns:
                 row (Row): Row object. Access rows in these ways: row.some_row, row['some_row']
         """
-        if column is not None:
-            search_value = value
-            search_column = column.casefold()
-        else:
-            search_column = 'id'
-            if isinstance(value, discord.abc.User):
-                search_value = value.id
-            else:
-                search_value = value
+        search_column, search_value = self._member_search(value, column)
+        if self.member_cache.covers(search_column):
+            return self.member_cache.get(search_column, search_value)
 
         member_row = self.__get_row(self.tables['members'], self.tables['members'].c[search_column], search_value)
         return member_row
 
+    @staticmethod
+    def _member_search(value: discord.abc.User | int, column: str = None) -> tuple:
+        # Resolves the arguments of get_member() into a column name and a value to search it for
+        if column is not None:
+            return column.casefold(), value
+        if isinstance(value, discord.abc.User):
+            return 'id', value.id
+        return 'id', value
+
+    def _key_column(self, table: Table) -> Optional[Column]:
+        """
+        Returns the column that identifies a table's rows in the change journal: the primary key if there is exactly one,
+        or otherwise the 'id' column. Members are always identified by id, which is also the key of the member cache.
+        """
+        if table.name != 'members':
+            primary_key = list(table.primary_key.columns)
+            if len(primary_key) == 1:
+                return primary_key[0]
+        return table.c.get('id')
+
+    def _affected_keys(self, conn: sqlalchemy.engine.Connection, table: Table, where_clause) -> List:
+        # Finds the rows a write is about to touch, so they can be recorded afterwards
+        key_column = self._key_column(table)
+        if key_column is None:
+            return [None]
+        return list(conn.execute(select(key_column).where(where_clause)).scalars())
+
+    def _record_write(self, conn: sqlalchemy.engine.Connection, table: Table, operation: str, keys: List,
+                      columns) -> None:
+        """
+        Called by every method that writes, in the same transaction as the write.
+        Adds the changed rows to the change journal and keeps the member cache current.
+        """
+        self.journal.record(conn, table.name, operation, keys, columns)
+        if table.name == 'members':
+            if operation == 'delete':
+                self.member_cache.discard(keys)
+            else:
+                self.member_cache.refresh(conn, keys)
+
     def get_tag(self, value, column=None, filter_revoked=False):
         '''
         Returns a Row object that represents a single tag in the database
@@ -289,16 +853,20 @@ class HvzDb:
             if exclusion_value is None:
                 raise ValueError('No exclusion value provided.')
             selection = selection.where(exclusion_column != exclusion_value)
-        with self.engine.begin() as conn:
+        with self._connect() as conn:
             result_row = conn.execute(selection).first()
         if result_row is None:
             raise ValueError(f'Could not find a row where \"{search_column}\" is \"{search_value}\"')
         return result_row
 
-    def get_table(self, table) -> List[Row]:
+    def get_table(self, table, columns: List[str] = None) -> List[Row]:
+        """
+        Returns every row of a table. If columns is given, the rows have only those columns.
+        For large tables, iter_rows() avoids holding every row at once.
+        """
         _table = self._validate_table_selection(table)
-        selection = select(_table)
-        with self.engine.begin() as conn:
+        selection = self._select_columns(_table, columns)
+        with self._connect() as conn:
             result = conn.execute(selection).all()
             return result
 
@@ -310,8 +878,17 @@ class HvzDb:
                 values({_target_column: target_value})
         )
 
-        with self.engine.begin() as conn:
+        key_column = self._key_column(_table)
+        with self._connect() as conn:
+            if _search_column is key_column:
+                keys = [search_value]
+            else:
+                keys = self._affected_keys(conn, _table, _search_column == search_value)
             result = conn.execute(updator)
+            if result.rowcount > 0:
+                if _target_column is key_column:
+                    keys.append(target_value)
+                self._record_write(conn, _table, 'update', keys, [_target_column.name])
         if result.rowcount > 0:
             self._table_updated(_table)
             return True
@@ -323,13 +900,111 @@ class HvzDb:
         _search_column = self._validate_column_selection(_table, search_column)
 
         deletor = delete(_table).where(_search_column == search_value)
-        with self.engine.begin() as conn:
+        with self._connect() as conn:
+            if _search_column is self._key_column(_table):
+                keys = [search_value]
+            else:
+                keys = self._affected_keys(conn, _table, _search_column == search_value)
             result = conn.execute(deletor)
+            if result.rowcount > 0:
+                self._record_write(conn, _table, 'delete', keys, [])
         if result.rowcount < 1:
             raise ValueError(f'Could not find rows where \"{search_column}\" is \"{search_value}\"')
         self._table_updated(table)
         return True
 
+    # Bulk versions of the methods above. Each runs as one statement in one transaction, and notifies the
+    # Google Sheet once no matter how many rows change.
+
+    def add_rows(self, table_selection: str, input_rows: List[Dict]) -> sqlalchemy.engine.CursorResult:
+        """
+        Inserts many rows at once. Columns missing from some rows are filled with None.
+        """
+        table = self.tables[table_selection.casefold()]
+        if not input_rows:
+            raise ValueError('No rows provided to add.')
+
+        rows = [{k.casefold(): i for k, i in input_row.items()} for input_row in input_rows]
+        # Every row of an executemany must have the same keys
+        column_names = set().union(*rows)
+        rows = [{column_name: row.get(column_name) for column_name in column_names} for row in rows]
+
+        with self._connect() as conn:
+            result = conn.execute(table.insert(), rows)
+            # Keys generated by the database can't be read back from an executemany, so those are recorded as None
+            key_column = self._key_column(table)
+            keys = [None if key_column is None else row.get(key_column.name) for row in rows]
+            self._record_write(conn, table, 'insert', keys, sorted(column_names))
+        self._table_updated(table)
+        return result
+
+    def edit_rows(self, table: Table | str, search_column: str, changes: Dict[Any, Dict[str, Any]]) -> int:
+        """
+        Edits many rows at once.
+
+        Parameters:
+                table (str or Table): Table to edit
+                search_column (str): Column that identifies the rows to change
+                changes (dict): Maps values of search_column to a dictionary of {column name: new value}
+
+        Returns:
+                count (int): Number of rows changed
+        """
+        _table = self._validate_table_selection(table)
+        _search_column = self._validate_column_selection(_table, search_column)
+
+        key_column = self._key_column(_table)
+        # Rows that change the same columns can share one executemany
+        batches: Dict[tuple, List[Dict]] = {}
+        new_keys = []
+        for search_value, row_changes in changes.items():
+            row_changes = {k.casefold(): i for k, i in row_changes.items()}
+            self._validate_column_selection(_table, *row_changes.keys())
+            parameters = {f'new_{k}': i for k, i in row_changes.items()}
+            parameters['search_value'] = search_value
+            batches.setdefault(tuple(sorted(row_changes)), []).append(parameters)
+            if key_column is not None and key_column.name in row_changes:
+                new_keys.append(row_changes[key_column.name])
+
+        count = 0
+        with self._connect() as conn:
+            keys = self._affected_keys(conn, _table, _search_column.in_(list(changes)))
+            for column_names, parameter_list in batches.items():
+                updator = (
+                    update(_table).where(_search_column == bindparam('search_value')).
+                        values({_table.c[k]: bindparam(f'new_{k}') for k in column_names})
+                )
+                count += conn.execute(updator, parameter_list).rowcount
+            if count > 0:
+                changed_columns = sorted(set().union(*batches))
+                self._record_write(conn, _table, 'update', keys + new_keys, changed_columns)
+        if count > 0:
+            self._table_updated(_table)
+        return count
+
+    def delete_where(self, table: Union[Table, str], search_column: str = None, search_value=None) -> int:
+        """
+        Deletes every row where search_column equals search_value, or every row in the table if no column is given.
+        Unlike delete_row(), finding no rows is not an error.
+
+        Returns:
+                count (int): Number of rows deleted
+        """
+        _table = self._validate_table_selection(table)
+        if search_column is None:
+            where_clause = true()
+        else:
+            where_clause = self._validate_column_selection(_table, search_column) == search_value
+
+        with self._connect() as conn:
+            keys = self._affected_keys(conn, _table, where_clause)
+            result = conn.execute(delete(_table).where(where_clause))
+            if result.rowcount > 0:
+                self._record_write(conn, _table, 'delete', keys, [])
+        if result.rowcount > 0:
+            self._table_updated(_table)
+        return result.rowcount
+
     def get_rows(
             self,
             table: str,
@@ -338,7 +1013,8 @@ class HvzDb:
             lower_value=None,
             upper_value=None,
             exclusion_column_name: str =None,
-            exclusion_value=None
+            exclusion_value=None,
+            columns: List[str] = None
     ) -> List[Row]:
         """
         Returns a list of Row objects where the specified value matches.
@@ -350,12 +1026,236 @@ class HvzDb:
                 value (any): Value to search column for
                 exclusion_column_name (sqlalchemy.column) Optional. Reject rows where this column equals exclusion_value
                 exclusion_value (any) Optional. Required if exclusion_column_name is provided.
+                columns (List[str]) Optional. Return only these columns
 
         Returns:
                 result_rows: List of Row objects. Access rows in these ways: row.some_row, row['some_row']
         """
         _table = self._validate_table_selection(table)
-        selection = select(_table)
+        selection = self._filter_selection(
+            _table, self._select_columns(_table, columns), search_column_name, search_value, lower_value, upper_value,
+            exclusion_column_name, exclusion_value
+        )
+
+        with self._connect() as conn:
+            result_rows: List[Row] = conn.execute(selection).all()
+
+        if len(result_rows) == 0:
+            if lower_value:
+                raise ValueError(f'Could not find rows where "{search_column_name}" is between "{lower_value}" and "{upper_value}"')
+            else:
+                raise ValueError(f'Could not find rows where \"{search_column_name}\" is \"{search_value}\"')
+
+        return result_rows
+
+    def iter_rows(
+            self,
+            table: str,
+            columns: List[str] = None,
+            search_column_name: str = None,
+            search_value=None,
+            lower_value=None,
+            upper_value=None,
+            exclusion_column_name: str = None,
+            exclusion_value=None,
+            batch_size: int = 500
+    ) -> Iterator[Row]:
+        """
+        Yields rows a batch at a time from a server-side cursor, so even a huge table is read in bounded memory.
+        Takes the same filters as get_rows(), but with no search_column_name yields the whole table, and yields nothing
+        rather than raising when no rows match.
+        The connection stays open until the iterator is exhausted or closed, so consume it on the same thread and promptly.
+        """
+        _table = self._validate_table_selection(table)
+        selection = self._select_columns(_table, columns)
+        if search_column_name is not None:
+            selection = self._filter_selection(
+                _table, selection, search_column_name, search_value, lower_value, upper_value,
+                exclusion_column_name, exclusion_value
+            )
+        selection = selection.execution_options(stream_results=True)
+
+        with self._connect() as conn:
+            for partition in conn.execute(selection).partitions(batch_size):
+                yield from partition
+
+    def page(
+            self,
+            table: str,
+            order_by: str,
+            after_key=None,
+            limit: int = 20,
+            columns: List[str] = None,
+            search_column_name: str = None,
+            search_value=None
+    ) -> List[Row]:
+        """
+        Returns one page of rows ordered by a column, starting after the given key.
+        Pass the order_by value of the last row of one page as after_key to get the next. None starts from the beginning.
+        Since each page seeks straight to its key, later pages cost no more than the first.
+        The order_by column should be unique, or rows sharing a key across a page boundary are skipped.
+        """
+        _table = self._validate_table_selection(table)
+        _order_column = self._validate_column_selection(_table, order_by)
+        selection = self._select_columns(_table, columns).order_by(_order_column).limit(limit)
+        if after_key is not None:
+            selection = selection.where(_order_column > after_key)
+        if search_column_name is not None:
+            selection = selection.where(self._validate_column_selection(_table, search_column_name) == search_value)
+        with self._connect() as conn:
+            return conn.execute(selection).all()
+
+    def count_rows(
+            self,
+            table: str,
+            search_column_name: str = None,
+            search_value=None,
+            lower_value=None,
+            upper_value=None,
+            exclusion_column_name: str = None,
+            exclusion_value=None
+    ) -> int:
+        """
+        Returns the number of rows that get_rows() would return with the same arguments, without loading them.
+        With no search_column_name, counts the whole table. Returns 0 instead of raising ValueError when nothing matches.
+        """
+        return self.aggregate(
+            table, 'count', search_column_name=search_column_name, search_value=search_value,
+            lower_value=lower_value, upper_value=upper_value,
+            exclusion_column_name=exclusion_column_name, exclusion_value=exclusion_value
+        )
+
+    def aggregate(
+            self,
+            table: str,
+            function: str,
+            column_name: str = None,
+            group_by: str = None,
+            search_column_name: str = None,
+            search_value=None,
+            lower_value=None,
+            upper_value=None,
+            exclusion_column_name: str = None,
+            exclusion_value=None
+    ) -> Union[Any, Dict[Any, Any]]:
+        """
+        Computes count, sum, min or max of a column over the rows matching the same filters as get_rows().
+        Count with no column_name counts rows.
+
+        Parameters:
+                function (str): One of the keys of aggregate_functions
+                column_name (str): The column to aggregate. Optional for count
+                group_by (str): Optional. Returns a dictionary of each value of this column to its result
+
+        Returns:
+                The single result, or a dictionary when group_by is given. Groups with no rows are absent from it.
+        """
+        _table = self._validate_table_selection(table)
+        try:
+            aggregate_function = self.aggregate_functions[function.casefold()]
+        except KeyError:
+            raise ValueError(f'{function} is not a valid aggregate function.') from None
+        if column_name is not None:
+            result_column = aggregate_function(self._validate_column_selection(_table, column_name))
+        elif function.casefold() == 'count':
+            result_column = func.count()
+        else:
+            raise ValueError(f'A column must be given to find the {function}.')
+
+        if group_by is None:
+            selection = select(result_column).select_from(_table)
+        else:
+            _group_column = self._validate_column_selection(_table, group_by)
+            selection = select(_group_column, result_column).group_by(_group_column)
+        if search_column_name is not None:
+            selection = self._filter_selection(
+                _table, selection, search_column_name, search_value, lower_value, upper_value,
+                exclusion_column_name, exclusion_value
+            )
+        elif exclusion_column_name is not None:
+            _exclusion_column = self._validate_column_selection(_table, exclusion_column_name)
+            selection = selection.where(_exclusion_column != exclusion_value)
+
+        with self._connect() as conn:
+            if group_by is None:
+                return conn.execute(selection).scalar()
+            return {group: result for group, result in conn.execute(selection)}
+
+    def game_table(self, conn: sqlalchemy.engine.Connection, game: str, table_name: str) -> Optional[Table]:
+        """
+        Returns a table of any game: the live table for the active game, or one reflected from another game's attached
+        database. Returns None if that game has no such table, or its database isn't attached.
+        """
+        if game == self.active_game:
+            return self.tables.get(table_name)
+        if game not in self.games:
+            raise ValueError(f'There is no game called "{game}". The games are: {", ".join(self.games)}')
+        self._attach_games(conn)
+        key = (game, table_name)
+        if key not in self._game_tables:
+            try:
+                self._game_tables[key] = Table(table_name, MetaData(), schema=schema_name(game), autoload_with=conn)
+            except NoSuchTableError:
+                self._game_tables[key] = None
+            except OperationalError:
+                return None  # Not attached, such as a game whose file doesn't exist yet
+        return self._game_tables[key]
+
+    def _games_with_table(self, conn: sqlalchemy.engine.Connection, table_name: str,
+                          games: List[str] = None) -> Iterator[tuple]:
+        # The active game comes first, so a UNION takes its column types from the live table
+        games = games or list(self.games)
+        for game in sorted(games, key=lambda game: game != self.active_game):
+            game_table = self.game_table(conn, game, table_name)
+            if game_table is not None:
+                yield game, game_table
+
+    def get_rows_all_games(self, table: str, columns: List[str] = None, games: List[str] = None) -> List[Row]:
+        """
+        Returns the rows of a table from every game, or the given games, in one UNION ALL query.
+        Each row starts with a 'game' column. Values are read with the active game's column types,
+        and are None where a game's table doesn't have the column.
+        """
+        _table = self._validate_table_selection(table)
+        column_names = [column.casefold() for column in columns] if columns else [column.name for column in _table.columns]
+        target_columns = [self._validate_column_selection(_table, column_name) for column_name in column_names]
+
+        with self._connect() as conn:
+            selections = [
+                select(literal(game).label('game'), *(
+                    type_coerce(game_table.c[column.name] if column.name in game_table.c else null(), column.type).label(column.name)
+                    for column in target_columns
+                ))
+                for game, game_table in self._games_with_table(conn, _table.name, games)
+            ]
+            if not selections:
+                return []
+            return conn.execute(union_all(*selections)).all()
+
+    def count_rows_all_games(self, table: str, games: List[str] = None) -> Dict[str, int]:
+        """Returns the number of rows in a table for every game that has it, or the given games, in one query."""
+        _table = self._validate_table_selection(table)
+        with self._connect() as conn:
+            selections = [
+                select(literal(game).label('game'), func.count().label('row_count')).select_from(game_table)
+                for game, game_table in self._games_with_table(conn, _table.name, games)
+            ]
+            if not selections:
+                return {}
+            return {row.game: row.row_count for row in conn.execute(union_all(*selections))}
+
+    def _select_columns(self, _table: Table, columns: List[str] = None):
+        # Selects only the given columns, or the whole table if there are none
+        if not columns:
+            return select(_table)
+        _columns = self._validate_column_selection(_table, *(column.casefold() for column in columns))
+        if isinstance(_columns, Column):
+            _columns = [_columns]
+        return select(*_columns)
+
+    def _filter_selection(self, _table: Table, selection, search_column_name: str, search_value, lower_value,
+                          upper_value, exclusion_column_name: str, exclusion_value):
+        # The filters shared by get_rows(), count_rows() and aggregate()
         _search_column = self._validate_column_selection(_table, search_column_name)
 
         if search_value:
@@ -370,17 +1270,94 @@ class HvzDb:
             if not exclusion_value:
                 raise ValueError('No exclusion value provided.')
             selection = selection.where(_exclusion_column != exclusion_value)
+        return selection
 
-        with self.engine.begin() as conn:
-            result_rows: List[Row] = conn.execute(selection).all()
-
-        if len(result_rows) == 0:
-            if lower_value:
-                raise ValueError(f'Could not find rows where "{search_column_name}" is between "{lower_value}" and "{upper_value}"')
-            else:
-                raise ValueError(f'Could not find rows where \"{search_column_name}\" is \"{search_value}\"')
+    # Awaitable versions of the methods above. Cogs and chatbots should use these so that database work runs on the
+    # database thread instead of stalling the Discord gateway. The synchronous methods remain for scripts.
 
-        return result_rows
+    async def arun(self, function: Callable, *args, **kwargs) -> Any:
+        """
+        Runs a synchronous function on the database thread and waits for its result without blocking the event loop.
+        Useful for multistep database work, such as generating the tag tree, that has no awaitable method of its own.
+        """
+        transaction = _current_transaction.get()
+        if transaction is None:
+            if self.transaction_lock.locked():
+                # Another task has a transaction open. Running now could stall the database thread on SQLite's write lock.
+                async with self.transaction_lock:
+                    pass
+        elif transaction.connection is None:
+            await transaction.start()
+        return await self._run_on_db_thread(function, *args, **kwargs)
+
+    async def _run_on_db_thread(self, function: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        # The function runs in a copy of this context, so it sees any transaction this task has open
+        context = contextvars.copy_context()
+        # Slow queries on the database thread are logged with the coroutine that asked for them
+        context.run(query_origin.set, describe_caller())
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, function, *args, **kwargs))
+
+    async def aadd_row(self, table_selection: str, input_row: Dict) -> sqlalchemy.engine.CursorResult:
+        return await self.arun(self.add_row, table_selection, input_row)
+
+    async def aget_member(self, value: discord.abc.User | int, column: str = None) -> Row:
+        if self.member_cache.covers(self._member_search(value, column)[0]):
+            # Cached lookups are dictionary hits, so there is no reason to leave the event loop
+            return self.get_member(value, column)
+        return await self.arun(self.get_member, value, column)
+
+    async def aget_tag(self, value, column=None, filter_revoked=False) -> Row:
+        return await self.arun(self.get_tag, value, column, filter_revoked)
+
+    async def aget_table(self, table, columns: List[str] = None) -> List[Row]:
+        return await self.arun(self.get_table, table, columns)
+
+    async def aedit_row(self, table: Table | str, search_column: str, search_value, target_column: str, target_value):
+        return await self.arun(self.edit_row, table, search_column, search_value, target_column, target_value)
+
+    async def adelete_row(self, table: Union[Table, str], search_column: str, search_value):
+        return await self.arun(self.delete_row, table, search_column, search_value)
+
+    async def aadd_rows(self, table_selection: str, input_rows: List[Dict]) -> sqlalchemy.engine.CursorResult:
+        return await self.arun(self.add_rows, table_selection, input_rows)
+
+    async def aedit_rows(self, table: Table | str, search_column: str, changes: Dict[Any, Dict[str, Any]]) -> int:
+        return await self.arun(self.edit_rows, table, search_column, changes)
+
+    async def adelete_where(self, table: Union[Table, str], search_column: str = None, search_value=None) -> int:
+        return await self.arun(self.delete_where, table, search_column, search_value)
+
+    async def aget_rows(self, table: str, search_column_name: str, *args, **kwargs) -> List[Row]:
+        return await self.arun(self.get_rows, table, search_column_name, *args, **kwargs)
+
+    async def apage(self, table: str, order_by: str, *args, **kwargs) -> List[Row]:
+        return await self.arun(self.page, table, order_by, *args, **kwargs)
+
+    async def acount_rows(self, table: str, *args, **kwargs) -> int:
+        return await self.arun(self.count_rows, table, *args, **kwargs)
+
+    async def aaggregate(self, table: str, function: str, *args, **kwargs) -> Union[Any, Dict[Any, Any]]:
+        return await self.arun(self.aggregate, table, function, *args, **kwargs)
+
+    async def aget_rows_all_games(self, table: str, *args, **kwargs) -> List[Row]:
+        return await self.arun(self.get_rows_all_games, table, *args, **kwargs)
+
+    async def acount_rows_all_games(self, table: str, *args, **kwargs) -> Dict[str, int]:
+        return await self.arun(self.count_rows_all_games, table, *args, **kwargs)
+
+    async def aswitch_game(self, game: str) -> None:
+        # Held so that no transaction is open on the old game's file while it closes
+        async with self.transaction_lock:
+            await self._run_on_db_thread(self.switch_game, game)
+
+    def close(self) -> None:
+        """Waits for queued database work to finish, then releases the database thread and connections."""
+        if self.sheet_interface is not None:
+            self.sheet_interface.close()
+        self.executor.shutdown(wait=True)
+        self.engine.dispose()
 
 
 # Below is just for testing when this file is run from the command line
@@ -1,12 +1,15 @@
+import asyncio
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from inspect import getmembers, isclass
-from typing import TYPE_CHECKING, Dict, List, Union, Set
+from typing import TYPE_CHECKING, Dict, List, Union, Set, Optional
 
 import discord
+import numpy as np
 import pandas as pd
 import pandas.util
 import plotly.express as px
@@ -16,6 +19,7 @@ from loguru import logger
 
 from .utilities import pool_function, have_lists_changed
 from .config import config
+from .database import create_database_engine, load_performance_profile
 
 if TYPE_CHECKING:
     from database import HvzDb
@@ -24,47 +28,114 @@ if TYPE_CHECKING:
 guild_id_list = [config['server_id']]
 LAST_GAME_PLOT_HASH = None
 
+panel_table_columns = {
+    'channel_id': 'integer',
+    'message_id': 'integer',
+    'elements': 'string'
+}
+
+# Plots are drawn here rather than on the database thread, since drawing one can take seconds on a slow machine.
+# One thread, so the plot image file is only ever written by one plot at a time.
+PLOT_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='plots')
+
+
+@dataclass
+class GamePlotData:
+    """What a game plot is drawn from. tags_df is None if the last image drawn is still current."""
+    image_path: Path
+    data_hash: int
+    tags_df: Optional[pd.DataFrame]
+
+
 def create_game_plot(db: 'HvzDb', filepath=None) -> discord.File:
-    global LAST_GAME_PLOT_HASH
+    """Reads the plot's data and draws it, all on the calling thread. The panels use read_game_plot() and render_game_plot()."""
+    return render_game_plot(read_game_plot(db, filepath))
+
+
+def read_game_plot(db: 'HvzDb', filepath=None) -> GamePlotData:
+    """Reads and counts what the game plot needs. Call it on the database thread."""
     image_folder = config.path_root / "plots"
     if not image_folder.exists():
         image_folder.mkdir()
     image_path = image_folder / "latest_gameplot.jpeg"
 
-    if not filepath:
-        filepath: str = str(db.filepath)
-    # TODO: Access the database in a more sustainable way
-    engine = sqlalchemy.create_engine(f"sqlite+pysqlite:///{str(filepath)}")
-    tags_df = pd.read_sql_table('tags', con=engine, columns=['tag_time', 'revoked_tag'])
+    if filepath:
+        # Such as a backup snapshot, which should be read as it is rather than switched to write-ahead logging
+        profile = {k: i for k, i in load_performance_profile().items() if k != 'journal_mode'}
+        engine = create_database_engine(filepath, profile)
+    else:
+        engine = db.engine
+    try:
+        # Pandas is given a connection, since it can't run queries on a future-style engine by itself
+        with engine.connect() as conn:
+            return _read_game_plot(conn, image_path)
+    finally:
+        if engine is not db.engine:
+            engine.dispose()
+
+
+def _epoch_seconds(times: pd.Series) -> pd.Series:
+    """
+    Returns times as epoch seconds, with NaN where there is no time.
+    Timestamp columns already are, while older DateTime columns hold text in the config's time zone.
+    """
+    if pd.api.types.is_numeric_dtype(times):
+        return times.astype('float64')
+    times = pd.to_datetime(times, errors='coerce')
+    if times.dt.tz is None:
+        times = times.dt.tz_localize(config.time_zone, ambiguous='NaT', nonexistent='NaT')
+    return (times - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+
+
+def _read_game_plot(conn: sqlalchemy.engine.Connection, image_path: Path) -> GamePlotData:
+    # Read with plain SQL, so times stay as the integers they are stored as instead of being made into datetimes
+    tags_df = pd.read_sql_query(sqlalchemy.text('SELECT tag_time, revoked_tag FROM tags ORDER BY tag_time'), con=conn)
     new_hash = pandas.util.hash_pandas_object(tags_df).sum()
 
     if len(tags_df.index) == 0:
-        fig = px.line(tags_df, x="tag_time", y=["Zombie_Count", "Human_Count"], title='Error: There are no tags yet', markers=True)
-        fig.write_image(image_path, width=800, height=600, scale=1.5)
-        LAST_GAME_PLOT_HASH = new_hash
-
-
-    elif LAST_GAME_PLOT_HASH != new_hash or not image_path.exists():
-        members_df = pd.read_sql_table('members', con=engine, columns=['registration_time', 'oz'])
-
-        def total_players(x):
-            total = (members_df.registration_time < x.tag_time)
-            return total.sum()
-
-        def total_zombies(x):
-            # Note: The database is giving the revoked_tag column as object types, thus converting to in to compare
-            total = (tags_df.tag_time < x.tag_time) & (tags_df.revoked_tag.astype('int32') == 0)
-            return total.sum()
+        return GamePlotData(image_path, new_hash, tags_df)
+    if LAST_GAME_PLOT_HASH == new_hash and image_path.exists():
+        return GamePlotData(image_path, new_hash, None)
+
+    members_df = pd.read_sql_query(sqlalchemy.text('SELECT registration_time, oz FROM members'), con=conn)
+
+    tag_times = _epoch_seconds(tags_df.tag_time)
+    tags_df = tags_df[tag_times.notna()]
+    tag_times = tag_times[tag_times.notna()].to_numpy()
+    registration_times = np.sort(_epoch_seconds(members_df.registration_time).dropna().to_numpy())
+    # Note: The database is giving the revoked_tag column as object types, thus converting to in to compare
+    standing_tag_times = np.sort(tag_times[tags_df.revoked_tag.astype('int32').to_numpy() == 0])
+
+    oz_count = members_df['oz'].sum()
+
+    # For each tag, the players registered before it and the unrevoked tags before it, by binary search
+    player_count = np.searchsorted(registration_times, tag_times, side='left')
+    zombie_count = np.searchsorted(standing_tag_times, tag_times, side='left') + oz_count
+    tags_df = tags_df.assign(
+        tag_time=pd.to_datetime(tag_times, unit='s', utc=True).tz_convert(config.time_zone),
+        Player_Count=player_count,
+        Zombie_Count=zombie_count,
+        Human_Count=player_count - zombie_count
+    )
+    return GamePlotData(image_path, new_hash, tags_df)
+
+
+def render_game_plot(data: GamePlotData) -> discord.File:
+    """Draws the game plot to its image file, unless the image is current. The panels call this in PLOT_EXECUTOR."""
+    global LAST_GAME_PLOT_HASH
+    image_path = data.image_path
+    tags_df = data.tags_df
 
-        oz_count = members_df['oz'].sum()
+    if tags_df is None:
+        # The last image drawn is still current
+        return discord.File(image_path)
 
-        player_count_sr = tags_df.apply(total_players, axis=1)
-        tags_df = tags_df.assign(Player_Count=player_count_sr)
-        zombie_count_sr = tags_df.apply(total_zombies, axis=1) + oz_count
-        tags_df = tags_df.assign(Zombie_Count=zombie_count_sr)
-        tags_df['Human_Count'] = tags_df['Player_Count'] - tags_df['Zombie_Count']
-        tags_df.sort_values(by='tag_time', inplace=True)
+    if len(tags_df.index) == 0:
+        fig = px.line(tags_df, x="tag_time", y=["Zombie_Count", "Human_Count"], title='Error: There are no tags yet', markers=True)
+        fig.write_image(image_path, width=800, height=600, scale=1.5)
+        LAST_GAME_PLOT_HASH = data.data_hash
 
+    else:
         fig = px.line(tags_df, x="tag_time", y=["Zombie_Count", "Human_Count"], title='Players over Time', markers=True)
         fig.update_layout(
             xaxis_title = 'Tag Time',
@@ -89,7 +160,7 @@ def create_game_plot(db: 'HvzDb', filepath=None) -> discord.File:
         # fig.show()
 
         fig.write_image(image_path, width=800, height=600, scale=1.5)
-        LAST_GAME_PLOT_HASH = new_hash
+        LAST_GAME_PLOT_HASH = data.data_hash
 
     file = discord.File(image_path)
     return file
@@ -103,8 +174,13 @@ class PanelElement(ABC):
 
     @abstractmethod
     def add(self, embed: discord.Embed, panel: "HVZPanel") -> Union[discord.File, None]:
+        """Adds the element to the embed. Runs on the database thread."""
         ...
 
+    def render(self) -> Union[discord.File, None]:
+        """Makes the element's file from what add() read, if it has one. Runs in PLOT_EXECUTOR, off the database thread."""
+        return None
+
 
 class HumanElement(PanelElement):
     @property
@@ -143,17 +219,12 @@ class PlayersTodayElement(PanelElement):
 
 
     def add(self, embed: discord.Embed, panel: "HVZPanel") -> None:
-        try:
-            rows = panel.bot.db.get_rows(
-                table='members',
-                search_column_name='registration_time',
-                lower_value=datetime.now(tz=config.time_zone) - timedelta(days=1),
-                upper_value=datetime.now(tz=config.time_zone)
-
-            )
-            count = len(rows)
-        except ValueError:
-            count = 0
+        count = panel.bot.db.count_rows(
+            table='members',
+            search_column_name='registration_time',
+            lower_value=datetime.now(tz=config.time_zone) - timedelta(days=1),
+            upper_value=datetime.now(tz=config.time_zone)
+        )
 
         extra = ''
         if not config['registration']:
@@ -167,29 +238,33 @@ class TagsTodayElement(PanelElement):
         return 'on_role_change'
 
     def add(self, embed: discord.Embed, panel: "HVZPanel") -> None:
-        try:
-            rows = panel.bot.db.get_rows(
-                table='tags',
-                search_column_name='tag_time',
-                lower_value=datetime.now(tz=config.time_zone) - timedelta(days=1),
-                upper_value=datetime.now(tz=config.time_zone)
-            )
-            count = len(rows)
-        except ValueError:
-            count = 0
+        count = panel.bot.db.count_rows(
+            table='tags',
+            search_column_name='tag_time',
+            lower_value=datetime.now(tz=config.time_zone) - timedelta(days=1),
+            upper_value=datetime.now(tz=config.time_zone)
+        )
 
         embed.add_field(name='Tags Today', value=str(count))
 
 
 class GamePlotElement(PanelElement):
+    plot_data: Optional[GamePlotData] = None
+
     @property
     def refresh_event(self):
         return 'on_role_change'
 
-    def add(self, embed: discord.Embed, panel: "HVZPanel") -> discord.File:
-        file = create_game_plot(panel.bot.db)
-        embed.set_image(url=f'attachment://{file.filename}')
-        return file
+    def add(self, embed: discord.Embed, panel: "HVZPanel") -> None:
+        snapshot = None
+        backup_cog = panel.bot.get_cog('BackupCog')
+        if backup_cog is not None and backup_cog.plots_use_backup:
+            snapshot = backup_cog.latest_snapshot()
+        self.plot_data = read_game_plot(panel.bot.db, filepath=snapshot)
+        embed.set_image(url=f'attachment://{self.plot_data.image_path.name}')
+
+    def render(self) -> discord.File:
+        return render_game_plot(self.plot_data)
 
 
 # Create a list of PanelElement classes available in the module
@@ -217,7 +292,7 @@ class HVZPanel:
         self.load_elements(element_names)
         self.channel = channel
 
-        embed, file = self.create_embed()
+        embed, file = await self.build_embed()
         kwargs = {'embed': embed}
         if file:
             kwargs.update({'file': file})
@@ -226,7 +301,7 @@ class HVZPanel:
         if self.live:
             self.cog.add_panel(self)
             self.setup_listeners()
-            self.save()
+            await self.save()
 
     def load_elements(self, element_names: List[Union[str, PanelElement]]) -> None:
         for name in element_names:
@@ -238,12 +313,27 @@ class HVZPanel:
         pool_function(self._refresh, 6.0)
 
     async def _refresh(self):
-        embed, file = self.create_embed()
+        embed, file = await self.build_embed()
         kwargs = {'embed': embed}
         if file:
             kwargs.update({'file': file})
         await self.message.edit(**kwargs)
 
+    async def build_embed(self) -> (discord.Embed, discord.File):
+        """
+        Makes the panel's embed. The elements read the database on the database thread, then any files, such as the
+        game plot, are drawn in PLOT_EXECUTOR, so drawing never holds up registrations and tags.
+        """
+        embed, output_file = await self.bot.db.arun(self.create_embed)
+        loop = asyncio.get_running_loop()
+        for element in self.elements:
+            if type(element).render is PanelElement.render:
+                continue  # Nothing to draw
+            file = await loop.run_in_executor(PLOT_EXECUTOR, element.render)
+            if file:
+                output_file = file
+        return embed, output_file
+
     def create_embed(self) -> (discord.Embed, discord.File):
         embed = discord.Embed(title='Game Status')
         output_file = None
@@ -265,7 +355,7 @@ class HVZPanel:
 
         return embed, output_file
 
-    def save(self):
+    async def save(self):
         row_data = {
             'channel_id': self.channel.id,
             'message_id': self.message.id
@@ -274,7 +364,7 @@ class HVZPanel:
         elements_string = ','.join([type(element).__name__ for element in self.elements])
         row_data.update({'elements': elements_string})
 
-        self.bot.db.add_row('persistent_panels', row_data)
+        await self.bot.db.aadd_row('persistent_panels', row_data)
 
     async def load(self, row: sqlalchemy.engine.Row) -> Union["HVZPanel", None]:
         self.channel = self.bot.guild.get_channel(row['channel_id'])
@@ -282,7 +372,7 @@ class HVZPanel:
             self.message = await self.channel.fetch_message(row['message_id'])
         except discord.NotFound:
             logger.warning('Could not find panel message. Removing it from the database.')
-            self.bot.db.delete_row('persistent_panels', 'message_id', row['message_id'])
+            await self.bot.db.adelete_row('persistent_panels', 'message_id', row['message_id'])
             return None
 
         self.load_elements(row['elements'].split(','))
@@ -312,23 +402,19 @@ class DisplayCog(discord.Cog, guild_ids=guild_id_list):
         self.roles_to_watch = []
         self.readied = False
 
-        bot.db.prepare_table('persistent_panels', columns={
-            'channel_id': 'integer',
-            'message_id': 'integer',
-            'elements': 'string'
-        })
+        bot.db.prepare_table('persistent_panels', columns=panel_table_columns, indexes=['message_id'])
 
     def add_panel(self, panel: "HVZPanel"):
         if self.panels.get(panel.message.id):
             raise ValueError(f'Panel with id {panel.message.id} already exists.')
         self.panels[panel.message.id] = panel
 
-    def delete_panel(self, message_id: int):
+    async def delete_panel(self, message_id: int):
         panel = self.panels.pop(message_id, None)
         if panel:
             panel.remove_listeners()
         try:
-            self.bot.db.delete_row('persistent_panels', 'message_id', message_id)
+            await self.bot.db.adelete_row('persistent_panels', 'message_id', message_id)
         except ValueError:
             pass
 
@@ -372,7 +458,7 @@ class DisplayCog(discord.Cog, guild_ids=guild_id_list):
             return # Don't do this on_ready event more than once
         self.readied = True
         # Load persistent panels from the database.
-        rows = self.bot.db.get_table('persistent_panels')
+        rows = await self.bot.db.aget_table('persistent_panels')
         for row in rows:
             loaded_panel = await HVZPanel(self).load(row)
             if not loaded_panel:
@@ -392,7 +478,7 @@ class DisplayCog(discord.Cog, guild_ids=guild_id_list):
     @discord.Cog.listener()
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         panel = self.panels.get(payload.message_id)
-        self.delete_panel(payload.message_id)
+        await self.delete_panel(payload.message_id)
         logger.debug(f'Removed panel with id: {payload.message_id}')
 
 def setup(bot): # this is called by Pycord to setup the cog
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Callable, Awaitable, Optional
+
+from googleapiclient.errors import HttpError
+from loguru import logger
+
+from discord_hvz.config import config
+
+# Google allows 60 write requests a minute per user, so the default stays a little under that.
+DEFAULT_EXPORT_SETTINGS: Dict[str, Any] = {
+    'requests_per_minute': 50,
+    'burst': 5,
+    'wait_seconds': 10,
+    'priority_tables': ['tags'],
+    'priority_wait_seconds': 2,
+    'max_staleness_seconds': 60,
+    'max_backoff_seconds': 300
+}
+
+FIRST_BACKOFF_SECONDS = 2.0
+
+
+def load_export_settings() -> Dict[str, Any]:
+    return config.section('google_sheet_rate', DEFAULT_EXPORT_SETTINGS)
+
+
+def is_transient(error: Exception) -> bool:
+    """Returns True for failures that go away by themselves: rate limiting, Google's server errors and network trouble."""
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return isinstance(error, (OSError, TimeoutError))
+
+
+class TokenBucket:
+    """
+    Allows bursts of up to capacity requests, refilled at a steady rate, so requests stay under a per-minute quota.
+    Only used from the event loop.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """Waits until the tokens are available and takes them. Returns the seconds waited."""
+        waited = 0.0
+        self._refill()
+        while self.tokens < tokens:
+            delay = (tokens - self.tokens) / self.rate_per_second
+            await asyncio.sleep(delay)
+            waited += delay
+            self._refill()
+        self.tokens -= tokens
+        return waited
+
+    def charge(self, tokens: float) -> None:
+        """Takes tokens for requests already made, without waiting. Any shortfall is waited out by the next acquire()."""
+        self._refill()
+        self.tokens -= tokens
+
+
+@dataclass
+class DirtyTable:
+    first_changed: float
+    last_changed: float
+
+
+class ExportScheduler:
+    """
+    Decides when changed tables are exported. Each export sends every changed table at once.
+
+    A table is exported once it has gone wait_seconds without changing, or priority_wait_seconds for the priority
+    tables, such as tags during play. A table that keeps changing is still exported within max_staleness_seconds of
+    its first change. Every request to Google takes a token from a bucket sized to Google's quota, so a burst of
+    changes turns into a bounded number of requests. An export waits for one token before it starts, and is charged
+    for any further requests it made once it is done. A failed export keeps its tables marked as changed and is retried with
+    exponential backoff. The export always reads the tables fresh, so the newest state is what finally gets sent.
+    """
+
+    def __init__(self, export: Callable[[List[str]], Awaitable[Optional[int]]], settings: Dict[str, Any] = None):
+        self.export = export
+        self.settings = settings or load_export_settings()
+        self.bucket = TokenBucket(
+            rate_per_second=float(self.settings['requests_per_minute']) / 60,
+            capacity=float(self.settings['burst'])
+        )
+        self.priority_tables = set(self.settings['priority_tables'] or [])
+        self.dirty: Dict[str, DirtyTable] = {}
+        self.failures = 0
+        self._retry_time = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_dirty(self, table_name: str) -> None:
+        """Notes that a table changed. Must be called from the event loop's thread."""
+        now = time.monotonic()
+        entry = self.dirty.get(table_name)
+        if entry is None:
+            self.dirty[table_name] = DirtyTable(first_changed=now, last_changed=now)
+        else:
+            entry.last_changed = now
+        if self._task is None or self._task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Changed before the bot started, such as by a script. The table stays marked for the first export.
+                return
+            # Made on first use so that it belongs to the running event loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        self._wakeup.set()
+
+    def _wait_seconds(self, table_name: str) -> float:
+        if table_name in self.priority_tables:
+            return float(self.settings['priority_wait_seconds'])
+        return float(self.settings['wait_seconds'])
+
+    def next_export_time(self) -> Optional[float]:
+        """Returns when, by time.monotonic(), the next export is due, or None if nothing has changed."""
+        if not self.dirty:
+            return None
+        max_staleness = float(self.settings['max_staleness_seconds'])
+        due = min(
+            min(entry.last_changed + self._wait_seconds(table_name), entry.first_changed + max_staleness)
+            for table_name, entry in self.dirty.items()
+        )
+        return max(due, self._retry_time)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            due = self.next_export_time()
+            timeout = None if due is None else due - time.monotonic()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Exports every changed table now, waiting only for the token bucket."""
+        await self.bucket.acquire()
+        exporting = self.dirty
+        self.dirty = {}
+        if not exporting:
+            return
+        # The priority tables go first, although they all go in one request
+        table_names = sorted(exporting, key=lambda table_name: table_name not in self.priority_tables)
+        try:
+            requests = await self.export(table_names)
+        except Exception as e:
+            self._retry(exporting, e)
+        else:
+            if requests:
+                # The first request was paid for before the export
+                self.bucket.charge(requests - 1)
+            if self.failures:
+                logger.info(f'The Google Sheet export worked again after {self.failures} failed attempts.')
+            self.failures = 0
+            self._retry_time = 0.0
+
+    def _retry(self, exporting: Dict[str, DirtyTable], error: Exception) -> None:
+        # Tables that changed again during the export keep their newer change time, but their first change is the oldest
+        for table_name, entry in exporting.items():
+            newer = self.dirty.get(table_name)
+            if newer is not None:
+                entry.last_changed = newer.last_changed
+            self.dirty[table_name] = entry
+
+        self.failures += 1
+        max_backoff = float(self.settings['max_backoff_seconds'])
+        backoff = min(FIRST_BACKOFF_SECONDS * 2 ** (self.failures - 1), max_backoff)
+        backoff *= random.uniform(0.8, 1.2)  # So many bots don't retry in step
+        self._retry_time = time.monotonic() + backoff
+        if is_transient(error):
+            logger.warning(
+                f'The Google Sheet export failed ({error}). Retrying in {backoff:.0f} seconds. Attempt {self.failures}.'
+            )
+        else:
+            logger.opt(exception=error).error(
+                f'The Google Sheet export failed and may need fixing: {error} Retrying in {backoff:.0f} seconds.'
+            )
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
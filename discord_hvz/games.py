@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+from discord_hvz.config import config, ConfigError
+
+# SQLite attaches at most this many databases to a connection unless it was compiled with a higher limit
+MAX_ATTACHED_GAMES = 10
+
+_GAME_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+def load_game_paths(reload: bool = False) -> Dict[str, Path]:
+    """
+    Returns the database file of every game, by name. The game at 'database_path' is always included, named after its file.
+    More games come from the optional 'database_games' config section, read from the file again if reload is True.
+    """
+    games = {config.db_path.stem: config.db_path}
+    try:
+        configured = (config.reload('database_games') if reload else config['database_games']) or {}
+    except ConfigError:
+        return games
+    for name, path in configured.items():
+        name = str(name)
+        if not _GAME_NAME.match(name):
+            raise ConfigError(
+                f'The game name "{name}" in "database_games" in {config.filepath.name} can only have letters, numbers and underscores.'
+            )
+        path = config.path_root / str(path)
+        if path.suffix != '.db':
+            raise ConfigError(f'The database file of the game "{name}" in "database_games" must end in ".db". Given path: {path}')
+        games[name] = path
+    return games
+
+
+def load_active_game(games: Dict[str, Path]) -> str:
+    """Returns the game named by the optional 'active_game' config setting, or the game at 'database_path'."""
+    try:
+        active_game: Optional[str] = config['active_game']
+    except ConfigError:
+        active_game = None
+    if not active_game:
+        return config.db_path.stem
+    if str(active_game) not in games:
+        raise ConfigError(
+            f'"active_game" in {config.filepath.name} is "{active_game}", which is not one of the games: {", ".join(games)}'
+        )
+    return str(active_game)
+
+
+def schema_name(game: str) -> str:
+    """The name a game's database is attached under, for use as a table's schema."""
+    return f'game_{game.casefold()}'
@@ -8,7 +8,7 @@ from discord.commands import SlashCommandGroup, Option
 from discord.ext import commands
 from sqlalchemy.engine import Row
 
-from .utilities import respond_paginated
+from .utilities import respond_paginated_rows
 
 if TYPE_CHECKING:
     from main import HVZBot
@@ -19,6 +19,11 @@ from .config import config
 guild_id_list = [config['server_id']]
 
 table_name = 'items'
+table_columns = {
+    'id': 'incrementing_integer',
+    'name': 'string',
+    'owner': 'integer'
+}
 
 
 # Each item is unique and non-duplicable. Each player can have any number of items.
@@ -43,21 +48,17 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
     def __init__(self, bot: "HVZBot"):
         self.bot = bot
 
-        bot.db.prepare_table(table_name, columns={
-            'id': 'incrementing_integer',
-            'name': 'string',
-            'owner': 'integer'
-        })
+        bot.db.prepare_table(table_name, columns=table_columns, indexes=['owner'])
 
-    def get_item(self, id: int) -> Row:
+    async def get_item(self, id: int) -> Row:
         try:
-            return self.bot.db.get_rows(table_name, 'id', id)[0]
+            return (await self.bot.db.aget_rows(table_name, 'id', id))[0]
         except ValueError:
             raise ValueError(f'There is no item with the id {id} in the database.')
 
-    def edit_item(self, id: int, attribute: str, value: Union[str, int]) -> None:
+    async def edit_item(self, id: int, attribute: str, value: Union[str, int]) -> None:
         db = self.bot.db
-        db.edit_row(
+        await db.aedit_row(
             table_name,
             'id',
             id,
@@ -75,29 +76,27 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
         """
         # TODO: Make the printout a bit more elegant
 
-        if member:
-            try:
-                items = self.bot.db.get_rows(table_name, 'owner', member.id)
-                msg = f'*Items belonging to <@{member.id}>:*'
-            except ValueError:
-                await ctx.respond(f'<@{member.id}> has no items.')
-                return
-        else:
-            items = self.bot.db.get_table(table_name)
-            msg = '*All Items:*'
-
-        if len(items) == 0:
-            await ctx.respond(f'There are no items yet. Use `/item create` to make one.')
-            return
-
-        for item in items:
+        def format_item(item) -> str:
             if item.owner == 0:
                 owner = '*In Storage*'
             else:
                 owner = f'<@{item.owner}>'
-            msg += f"\n{item.id}  {item.name} {owner} "
+            return f"\n{item.id}  {item.name} {owner} "
+
+        if member:
+            found = await respond_paginated_rows(
+                ctx, self.bot.db, table_name, format_item, header=f'*Items belonging to <@{member.id}>:*',
+                columns=['id', 'name', 'owner'], search_column_name='owner', search_value=member.id
+            )
+            if not found:
+                await ctx.respond(f'<@{member.id}> has no items.')
+            return
 
-        await respond_paginated(ctx, msg)
+        found = await respond_paginated_rows(
+            ctx, self.bot.db, table_name, format_item, header='*All Items:*', columns=['id', 'name', 'owner']
+        )
+        if not found:
+            await ctx.respond(f'There are no items yet. Use `/item create` to make one.')
 
     @item_group.command(name='create')
     async def item_create(
@@ -115,11 +114,11 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
 
         if starting_player:
             try:
-                row['owner'] = self.bot.db.get_member(starting_player)['id']
+                row['owner'] = (await self.bot.db.aget_member(starting_player))['id']
             except ValueError:
                 await ctx.respond('The given member is not a registered player.')
                 return
-        result = self.bot.db.add_row(table_name, row)
+        result = await self.bot.db.aadd_row(table_name, row)
         new_id = result.inserted_primary_key[0]
         msg = f'Item named "{name}" created with ID "{new_id}".'
         if starting_player:
@@ -137,12 +136,12 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
         Completely deletes an item.
         """
         try:
-            item = self.get_item(id)
+            item = await self.get_item(id)
         except ValueError:
             await ctx.respond(f'There is no item with the id "{id}".')
             return
 
-        self.bot.db.delete_row(table_name, 'id', id)
+        await self.bot.db.adelete_row(table_name, 'id', id)
         msg = f'Deleted item "{item.name}" with ID "{id}"'
         owner = item['owner']
         if owner != 0:
@@ -164,10 +163,7 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
             await ctx.respond('Did not delete anything.')
             return
 
-        table = self.bot.db.get_table(table_name)
-
-        for row in table:
-            self.bot.db.delete_row(table_name, 'id', row['id'])
+        await self.bot.db.adelete_where(table_name)
 
         await ctx.respond('Deleted all items.')
 
@@ -181,18 +177,18 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
         Transfers an item to a player from either storage or another player.
         """
         try:
-            item = self.get_item(id)
+            item = await self.get_item(id)
         except ValueError:
             await ctx.respond(f'There is no item with the id "{id}".')
             return
 
         try:
-            self.bot.db.get_member(target_player)
+            await self.bot.db.aget_member(target_player)
         except ValueError:
             await ctx.respond('The given member is not a registered player.')
             return
 
-        self.edit_item(id, 'owner', target_player.id)
+        await self.edit_item(id, 'owner', target_player.id)
 
         if item.owner == 0:
             original_owner = 'storage'
@@ -211,7 +207,7 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
         """
 
         try:
-            item = self.get_item(id)
+            item = await self.get_item(id)
         except ValueError:
             await ctx.respond(f'There is no item with the id "{id}".')
             return
@@ -220,7 +216,7 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
             await ctx.respond(f'"{item.name}" is already in storage.')
             return
 
-        self.edit_item(id, 'owner', 0)
+        await self.edit_item(id, 'owner', 0)
 
         await ctx.respond(f'Item "{item.name}" taken from <@{item.owner}> and put in storage.')
 
@@ -234,7 +230,7 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
         Changes an item's name.
         """
         try:
-            item = self.get_item(id)
+            item = await self.get_item(id)
         except ValueError:
             await ctx.respond(f'There is no item with the id "{id}".')
             return
@@ -243,6 +239,6 @@ class ItemTrackerCog(commands.Cog, guild_ids=guild_id_list):
             await ctx.respond(f'Item is already named "{item.name}".')
             return
 
-        self.edit_item(id, 'name', new_name)
+        await self.edit_item(id, 'name', new_name)
 
         await ctx.respond(f'Item "{item.name}" renamed to {new_name}.')
@@ -25,6 +25,8 @@ from discord_hvz.buttons import HVZButtonCog
 from discord_hvz.chatbot import ChatBotManager
 from discord_hvz.display import DisplayCog
 from discord_hvz.item_tracker import ItemTrackerCog
+from discord_hvz.backup import BackupCog
+from discord_hvz.archive import ArchiveCog
 
 from discord_hvz.config import config, ConfigError, ConfigChecker
 from discord_hvz.database import HvzDb
@@ -200,6 +202,11 @@ class HVZBot(discord.ext.commands.Bot):
                 if msg:
                     raise StartupError(msg)
 
+                if self.db.sheet_interface is not None:
+                    # Sends changes that hadn't reached the Google Sheet when the bot last stopped.
+                    # Failed exports while the bot runs are retried by the export scheduler instead.
+                    await self.db.sheet_interface.resume()
+
                 log.success(
                     f'Discord-HvZ Bot launched correctly! Logged in as: {self.user.name} ------------------------------------------')
             except StartupError as e:
@@ -248,18 +255,19 @@ class HVZBot(discord.ext.commands.Bot):
         async def on_member_update(before, after):
             # When roles or nicknames change, update the database and sheet.
             try:
-                self.db.get_member(before.id)
+                member_row = await self.db.aget_member(before.id)
             except ValueError:
                 return
             if not before.roles == after.roles:
                 zombie = self.roles['zombie'] in after.roles
                 human = self.roles['human'] in after.roles
-                if zombie and not human:
-                    self.db.edit_row('members', 'id', after.id, 'faction', 'zombie')
-                elif human and not zombie:
-                    self.db.edit_row('members', 'id', after.id, 'faction', 'human')
+                # Tag commands usually save the faction before changing roles, so skip writes that change nothing
+                if zombie and not human and member_row.faction != 'zombie':
+                    await self.db.aedit_row('members', 'id', after.id, 'faction', 'zombie')
+                elif human and not zombie and member_row.faction != 'human':
+                    await self.db.aedit_row('members', 'id', after.id, 'faction', 'human')
             if not before.nick == after.nick:
-                self.db.edit_row('members', 'id', after.id, 'nickname', after.nick)
+                await self.db.aedit_row('members', 'id', after.id, 'nickname', after.nick)
                 log.debug(f'{after.name} changed their nickname.')
 
     def get_member(self, user_id: int):
@@ -315,8 +323,13 @@ def main():
         bot.load_extension('.commands', package = 'discord_hvz')
         bot.load_extension('.display', package = 'discord_hvz')
         bot.load_extension('.item_tracker', package = 'discord_hvz')
+        bot.load_extension('.backup', package = 'discord_hvz')
+        bot.load_extension('.archive', package = 'discord_hvz')
+        # Cogs only prepare their tables while loading. They are all created here at once.
+        bot.db.create_tables()
 
         bot.run(TOKEN)
+        bot.db.close()
 
     except discord.errors.LoginFailure as e:
         logger.error(f'Discord failed to log in: {e}')
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from typing import Dict, List, Any, Iterable, Tuple
+
+import sqlalchemy
+from sqlalchemy import Table, String, select
+from sqlalchemy.engine import Row
+
+
+class MemberCache:
+    """
+    An in-memory copy of the members table, with a hash index on each column members are commonly looked up by.
+    It is loaded once at startup. HvzDb refreshes the affected rows after every write to the members table, so
+    lookups are dictionary hits and the database only sees writes.
+    """
+    indexed_columns: Tuple[str, ...] = ('id', 'tag_code', 'discord_name', 'nickname', 'name')
+
+    def __init__(self, table: Table):
+        self.table = table
+        # The rows, mapped by member id, which doubles as the index of the 'id' column, and the other columns' indexes.
+        # Kept together so that load() can replace both with one assignment.
+        self._contents: Tuple[Dict[str, Row], Dict[str, Dict[Any, List[str]]]] = (
+            {}, {column: {} for column in self.indexed_columns if column in table.c and column != 'id'}
+        )
+
+    @property
+    def rows(self) -> Dict[str, Row]:
+        return self._contents[0]
+
+    @property
+    def indexes(self) -> Dict[str, Dict[Any, List[str]]]:
+        return self._contents[1]
+
+    def covers(self, column: str) -> bool:
+        """Returns True if lookups on this column can be answered by the cache."""
+        return column == 'id' or column in self.indexes
+
+    def load(self, conn: sqlalchemy.engine.Connection) -> None:
+        """
+        Replaces the contents of the cache with the whole members table. The new contents are built aside and swapped
+        in at once, so lookups from the event loop never find the cache half loaded.
+        """
+        rows: Dict[str, Row] = {}
+        indexes: Dict[str, Dict[Any, List[str]]] = {column: {} for column in self.indexes}
+        for row in conn.execute(select(self.table)):
+            self._insert(row, rows, indexes)
+        self._contents = (rows, indexes)
+
+    def get(self, column: str, value) -> Row:
+        """
+        Returns the first member row where the column matches the value.
+        Raises ValueError if there is none, just as the database lookups do.
+        """
+        key = self._key(column, value)
+        rows, indexes = self._contents
+        if column == 'id':
+            row = rows.get(key)
+        else:
+            ids = indexes[column].get(key, ())
+            row = next((rows.get(member_id) for member_id in ids), None)
+        if row is None:
+            raise ValueError(f'Could not find a row where "members.{column}" is "{value}"')
+        return row
+
+    def contains(self, column: str, value) -> bool:
+        """Returns True if any member has this value in the column."""
+        key = self._key(column, value)
+        rows, indexes = self._contents
+        if column == 'id':
+            return key in rows
+        return bool(indexes[column].get(key))
+
+    def refresh(self, conn: sqlalchemy.engine.Connection, member_ids: Iterable) -> None:
+        """Reloads the given members from the database, dropping any that no longer exist."""
+        member_ids = [str(member_id) for member_id in member_ids if member_id is not None]
+        if not member_ids:
+            return
+        found = set()
+        for row in conn.execute(select(self.table).where(self.table.c.id.in_(member_ids))):
+            found.add(str(row.id))
+            self._insert(row, *self._contents)
+        self.discard(set(member_ids) - found)
+
+    def discard(self, member_ids: Iterable) -> None:
+        rows, indexes = self._contents
+        for member_id in member_ids:
+            row = rows.pop(str(member_id), None)
+            if row is None:
+                continue
+            for column, index in indexes.items():
+                self._unindex(index, self._key(column, row[column]), str(member_id))
+
+    def _insert(self, row: Row, rows: Dict[str, Row], indexes: Dict[str, Dict[Any, List[str]]]) -> None:
+        if row.id is None:
+            return
+        member_id = str(row.id)
+        old_row = rows.get(member_id)
+        # New index entries are added before old ones are removed, so lookups from other threads never miss a member
+        for column, index in indexes.items():
+            new_key = self._key(column, row[column])
+            old_key = None if old_row is None else self._key(column, old_row[column])
+            if old_row is not None and new_key == old_key:
+                continue
+            if new_key is not None:
+                index.setdefault(new_key, []).append(member_id)
+            if old_key is not None:
+                self._unindex(index, old_key, member_id)
+        rows[member_id] = row
+
+    def _key(self, column: str, value):
+        # Match SQLite's comparison of values against text columns, such as an int id against a String column
+        if value is not None and isinstance(self.table.c[column].type, String):
+            return str(value)
+        return value
+
+    @staticmethod
+    def _unindex(index: Dict[Any, List[str]], key, member_id: str) -> None:
+        ids = index.get(key)
+        if not ids:
+            return
+        try:
+            ids.remove(member_id)
+        except ValueError:
+            return
+        if not ids:
+            del index[key]
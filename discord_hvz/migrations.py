@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Union, Any, TYPE_CHECKING
+
+import sqlalchemy
+from loguru import logger
+from sqlalchemy import Table, Column, Integer, String, DateTime, Boolean, MetaData, select
+from sqlalchemy.types import TypeDecorator
+
+from discord_hvz.column_types import Timestamp
+
+from discord_hvz.config import config
+
+if TYPE_CHECKING:
+    from discord_hvz.database import HvzDb
+
+# Rows are copied this many at a time when a table has to be rebuilt
+REBUILD_BATCH_SIZE = 500
+
+
+def get_user_version(conn: sqlalchemy.engine.Connection) -> int:
+    """Returns SQLite's user_version, which HvzDb increases by one on every change to the database's schema."""
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def get_schema_version(conn: sqlalchemy.engine.Connection) -> int:
+    """
+    Returns SQLite's schema_version, which SQLite itself increases on every CREATE, ALTER or DROP, whoever makes it.
+    Unlike user_version, it changes when someone edits the schema by hand, such as dropping a table with the sqlite3 CLI.
+    """
+    return conn.exec_driver_sql('PRAGMA schema_version').scalar()
+
+
+def bump_user_version(conn: sqlalchemy.engine.Connection) -> int:
+    """Increases the user_version by one and returns the new value. Call this after any CREATE, ALTER or DROP."""
+    version = get_user_version(conn) + 1
+    conn.exec_driver_sql(f'PRAGMA user_version = {version}')
+    return version
+
+
+@dataclass
+class MigrationPlan:
+    """The changes needed to make one existing table match the columns it should have."""
+    table_name: str
+    add_columns: List[Column] = field(default_factory=list)
+    # Columns whose type or primary key changed. SQLite can't alter these, so the table is rebuilt.
+    changed_columns: List[str] = field(default_factory=list)
+    # Columns in the database but not in the config. They are never dropped, since they may hold game data.
+    kept_columns: List[str] = field(default_factory=list)
+
+    @property
+    def rebuild(self) -> bool:
+        # SQLite can't ADD a primary key column either
+        return bool(self.changed_columns) or any(column.primary_key for column in self.add_columns)
+
+    @property
+    def empty(self) -> bool:
+        return not self.add_columns and not self.changed_columns
+
+    def describe(self) -> str:
+        changes = [f'add "{column.name}"' for column in self.add_columns]
+        changes.extend(f'change "{column_name}"' for column_name in self.changed_columns)
+        return ', '.join(changes)
+
+
+class SchemaMigrator:
+    """
+    Brings existing tables in line with the columns the config and cogs ask for, without deleting the database.
+    New columns are added with ALTER TABLE. Columns whose type changed are converted by copying the table into a new one.
+    Columns removed from the config are left in the database.
+
+    The schema_version table stores a hash of the columns each table was last migrated to, so on a normal boot,
+    when nothing changed, no table needs to be compared at all.
+    """
+    table_name = 'schema_version'
+
+    def __init__(self, db: HvzDb):
+        self.db = db
+        self.table = Table(
+            self.table_name, MetaData(),
+            Column('table_name', String, primary_key=True),
+            Column('schema_hash', String),
+            Column('version', Integer),
+            Column('migrated_time', DateTime)
+        )
+        with db.engine.begin() as conn:
+            if not sqlalchemy.inspect(conn).has_table(self.table_name):
+                self.table.create(conn)
+                bump_user_version(conn)
+            self.hashes: Dict[str, str] = {
+                row.table_name: row.schema_hash for row in conn.execute(select(self.table))
+            }
+
+    @staticmethod
+    def schema_hash(columns: Dict[str, Union[str, type]]) -> str:
+        """Returns a hash of a table's column names and types. Column order doesn't matter."""
+        normalized = {
+            name.casefold(): (column_type.casefold() if isinstance(column_type, str) else column_type.__name__.casefold())
+            for name, column_type in columns.items()
+        }
+        return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+    def up_to_date(self, table_name: str, columns: Dict[str, Union[str, type]]) -> bool:
+        """Returns True if the table was already migrated to these columns."""
+        return self.hashes.get(table_name) == self.schema_hash(columns)
+
+    def plan(self, table: Table, columns: Dict[str, Union[str, type]]) -> MigrationPlan:
+        """Compares a reflected table against the columns it should have."""
+        plan = MigrationPlan(table.name)
+        wanted = {name.casefold(): self.db._create_column_object(name, column_type) for name, column_type in columns.items()}
+        for column_name, column in wanted.items():
+            existing = table.c.get(column_name)
+            if existing is None:
+                plan.add_columns.append(column)
+            elif not self._same_type(existing, column) or existing.primary_key != column.primary_key:
+                plan.changed_columns.append(column_name)
+        plan.kept_columns = [column.name for column in table.columns if column.name not in wanted]
+        return plan
+
+    def migrate(self, table: Table, columns: Dict[str, Union[str, type]]) -> Table:
+        """
+        Migrates the table if its columns differ from those given, and records the new schema hash.
+        Returns the table, reflected again if it changed.
+        """
+        if self.up_to_date(table.name, columns):
+            return self._declare_types(table, columns)
+        plan = self.plan(table, columns)
+        if plan.kept_columns:
+            logger.info(
+                f'The table "{table.name}" has columns that are not in the config: {", ".join(plan.kept_columns)}. '
+                f'They have been kept, along with their data.'
+            )
+        with self.db.engine.begin() as conn:
+            if not plan.empty:
+                logger.warning(f'Migrating the table "{table.name}" to match the config: {plan.describe()}.')
+                if plan.rebuild:
+                    self._rebuild(conn, table, plan, columns)
+                else:
+                    for column in plan.add_columns:
+                        self._add_column(conn, table, column)
+                version = bump_user_version(conn)
+            else:
+                version = get_user_version(conn)
+            self._record(conn, table.name, columns, version)
+
+        if not plan.empty:
+            self.db.metadata_obj.remove(table)
+            table = Table(table.name, self.db.metadata_obj, autoload_with=self.db.engine)
+        return self._declare_types(table, columns)
+
+    def _declare_types(self, table: Table, columns: Dict[str, Union[str, type]]) -> Table:
+        """
+        Reflection only sees how a column is stored, such as INTEGER for a Timestamp.
+        Gives those columns back the type they were declared with, so their values are converted on the way in and out.
+        """
+        for name, column_type in columns.items():
+            declared_type = self.db._create_column_object(name, column_type).type
+            column = table.c.get(name.casefold())
+            if isinstance(declared_type, TypeDecorator) and column is not None and not isinstance(column.type, type(declared_type)):
+                column.type = declared_type
+        return table
+
+    def record_created(self, conn: sqlalchemy.engine.Connection, tables: Dict[str, Dict[str, Union[str, type]]],
+                       version: int) -> None:
+        """Records the schema of newly created tables, so they aren't compared on the next boot."""
+        for table_name, columns in tables.items():
+            self._record(conn, table_name, columns, version)
+
+    def _record(self, conn: sqlalchemy.engine.Connection, table_name: str, columns: Dict[str, Union[str, type]],
+                version: int) -> None:
+        schema_hash = self.schema_hash(columns)
+        values = {'schema_hash': schema_hash, 'version': version, 'migrated_time': datetime.now(tz=config.time_zone)}
+        if table_name in self.hashes:
+            conn.execute(self.table.update().where(self.table.c.table_name == table_name).values(values))
+        else:
+            conn.execute(self.table.insert().values(table_name=table_name, **values))
+        self.hashes[table_name] = schema_hash
+
+    @staticmethod
+    def _same_type(existing: Column, wanted: Column) -> bool:
+        # Reflected types are dialect subclasses, such as VARCHAR for String
+        if isinstance(existing.type, type(wanted.type)):
+            return True
+        # A column with a decorated type, such as Timestamp, reflects as the type it is stored as
+        return isinstance(wanted.type, TypeDecorator) and isinstance(existing.type, type(wanted.type.impl))
+
+    @staticmethod
+    def _add_column(conn: sqlalchemy.engine.Connection, table: Table, column: Column) -> None:
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+
+    def _rebuild(self, conn: sqlalchemy.engine.Connection, table: Table, plan: MigrationPlan,
+                 columns: Dict[str, Union[str, type]]) -> None:
+        """
+        Copies the table into a new one with the wanted columns, converting values to the new types, then swaps them.
+        Runs in the caller's transaction, so a failure leaves the old table as it was.
+        Indexes are lost and are recreated afterwards by HvzDb.
+        """
+        column_args = [self.db._create_column_object(name, column_type) for name, column_type in columns.items()]
+        column_args.extend(Column(name, table.c[name].type) for name in plan.kept_columns)
+        new_table = Table(f'_migrating_{table.name}', MetaData(), *column_args)
+        new_table.drop(conn, checkfirst=True)  # Left over from an interrupted migration
+        new_table.create(conn)
+
+        copied_columns = [column for column in new_table.columns if column.name in table.c]
+        failed_conversions = 0
+        result = conn.execute(select(*(table.c[column.name] for column in copied_columns)))
+        for partition in result.partitions(REBUILD_BATCH_SIZE):
+            rows = []
+            for row in partition:
+                new_row = {}
+                for column, value in zip(copied_columns, row):
+                    try:
+                        new_row[column.name] = self._convert(value, column)
+                    except (TypeError, ValueError):
+                        new_row[column.name] = None
+                        failed_conversions += 1
+                rows.append(new_row)
+            conn.execute(new_table.insert(), rows)
+
+        if failed_conversions:
+            logger.warning(
+                f'{failed_conversions} values in the table "{table.name}" could not be converted to their new column '
+                f'types and were left empty.'
+            )
+        conn.exec_driver_sql(f'DROP TABLE "{table.name}"')
+        conn.exec_driver_sql(f'ALTER TABLE "{new_table.name}" RENAME TO "{table.name}"')
+
+    @staticmethod
+    def _convert(value: Any, column: Column) -> Any:
+        """Converts a value read from the old table into the type of the new column. Raises ValueError if it can't."""
+        if value is None:
+            return None
+        if isinstance(column.type, Timestamp):
+            return Timestamp.to_epoch(value)
+        if isinstance(column.type, Boolean):
+            if isinstance(value, str):
+                if value.strip().casefold() in ('true', 'yes', 'y', '1'):
+                    return True
+                if value.strip().casefold() in ('false', 'no', 'n', '0', ''):
+                    return False
+                raise ValueError(value)
+            return bool(value)
+        if isinstance(column.type, Integer):
+            if isinstance(value, datetime):
+                return int(value.timestamp())
+            return int(value)
+        if isinstance(column.type, DateTime):
+            if isinstance(value, datetime):
+                return value
+            if isinstance(value, (int, float)):
+                return datetime.fromtimestamp(value, tz=config.time_zone)
+            return datetime.fromisoformat(str(value))
+        if isinstance(column.type, String):
+            if isinstance(value, datetime):
+                return value.isoformat(sep=' ')
+            return str(value)
+        return value
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import sqlalchemy
+from loguru import logger
+from sqlalchemy import event
+
+from discord_hvz.config import config, ConfigError
+
+DEFAULT_SLOW_QUERY_MS = 100.0
+
+# Upper bounds of the latency histogram buckets, in milliseconds. The last bucket holds everything slower.
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# The cog or command whose database work is running. HvzDb sets it for work sent to the database thread.
+query_origin: ContextVar[Optional[str]] = ContextVar('query_origin', default=None)
+
+# Modules that sit between a caller and the database, so are never reported as where a query came from
+_INTERNAL_MODULES = (
+    'sqlalchemy', 'contextlib', 'concurrent', 'threading', 'asyncio', 'functools',
+    'discord_hvz.database', 'discord_hvz.query_stats', 'discord_hvz.member_cache', 'discord_hvz.change_journal',
+    'discord_hvz.migrations'
+)
+
+# Runs of placeholders, such as the expanded parameters of an IN clause, are collapsed so those queries group together
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def load_slow_query_threshold() -> float:
+    """Returns the slow query threshold in milliseconds from the optional 'database_slow_query_ms' config setting."""
+    threshold = config.get('database_slow_query_ms', DEFAULT_SLOW_QUERY_MS)
+    try:
+        return float(threshold)
+    except (TypeError, ValueError):
+        raise ConfigError(f'"database_slow_query_ms" must be a number of milliseconds, not "{threshold}".') from None
+
+
+def describe_caller() -> str:
+    """Returns "module.function" of the nearest caller outside the database code, such as "commands.tag_delete"."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(_INTERNAL_MODULES):
+            return f'{module.rsplit(".", 1)[-1]}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+def statement_shape(statement: str) -> str:
+    statement = _PLACEHOLDER_LIST.sub('?, ...', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+@dataclass
+class StatementStats:
+    """Counts and timings for every statement with the same shape."""
+    statement: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    histogram: List[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BOUNDS_MS) + 1))
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile_ms(self, percentile: float) -> float:
+        """Estimates a percentile as the upper bound of the histogram bucket it falls in."""
+        target = self.count * percentile / 100
+        running_count = 0
+        for i, bucket_count in enumerate(self.histogram):
+            running_count += bucket_count
+            if running_count >= target and bucket_count:
+                return HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def add(self, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.histogram[bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+
+
+class QueryStats:
+    """
+    Times every SQL statement an engine runs, grouped by the statement's shape, and logs any slower than the threshold
+    along with the cog or command that made it. The numbers are shown by the /database_stats command.
+    """
+
+    def __init__(self, slow_query_ms: float = None):
+        self.slow_query_ms = load_slow_query_threshold() if slow_query_ms is None else slow_query_ms
+        self.statements: Dict[str, StatementStats] = {}
+        self.since = time.time()
+        self._lock = threading.Lock()
+
+    def install(self, engine: sqlalchemy.engine.Engine) -> None:
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        # A stack, since a statement may run while another on the same connection hasn't finished
+        conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed_ms = (time.perf_counter() - conn.info['query_start_times'].pop()) * 1000
+        shape = statement_shape(statement)
+        with self._lock:
+            stats = self.statements.get(shape)
+            if stats is None:
+                stats = self.statements[shape] = StatementStats(shape)
+            stats.add(elapsed_ms)
+        if elapsed_ms >= self.slow_query_ms:
+            origin = query_origin.get() or describe_caller()
+            logger.warning(f'Slow database query ({elapsed_ms:.1f} ms) from {origin}: {shape}')
+
+    def summary(self, limit: int = None) -> List[StatementStats]:
+        """Returns the statement stats with the most total time first."""
+        with self._lock:
+            statements = sorted(self.statements.values(), key=lambda stats: stats.total_ms, reverse=True)
+        return statements[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statements = {}
+            self.since = time.time()
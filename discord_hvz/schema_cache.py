@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import pickle
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import MetaData
+
+
+class SchemaCache:
+    """
+    A copy of the database's reflected MetaData, pickled next to the database file.
+    Reflecting every table on boot is slow on slow machines, so HvzDb reuses this instead while the database's schema
+    hasn't changed. The cache is keyed by SQLite's user_version and the schema_version hashes, which change whenever
+    HvzDb alters the schema, and by SQLite's own schema_version, which also changes when the schema is edited by hand.
+    A stale cache is simply ignored. Deleting the file is always safe.
+    """
+
+    def __init__(self, filepath: Optional[Path]):
+        # None for an in-memory database, which has nothing to cache between runs
+        self.filepath = filepath
+
+    @staticmethod
+    def make_key(user_version: int, sqlite_schema_version: int, schema_hashes: Dict[str, str]) -> Tuple:
+        return user_version, sqlite_schema_version, tuple(sorted(schema_hashes.items()))
+
+    def load(self, key: Tuple) -> Optional[MetaData]:
+        """Returns the cached MetaData if it was saved with this key, otherwise None."""
+        if self.filepath is None:
+            return None
+        try:
+            with open(self.filepath, 'rb') as file:
+                cached_key, metadata = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Such as a cache written by a different version of SQLAlchemy
+            logger.info(f'Ignoring the unreadable schema cache at {self.filepath}: {e}')
+            return None
+        if cached_key != key:
+            return None
+        return metadata
+
+    def save(self, key: Tuple, metadata: MetaData) -> None:
+        if self.filepath is None:
+            return
+        try:
+            # Written to a temporary file first, so a crash never leaves half a cache behind
+            temporary_path = self.filepath.with_name(self.filepath.name + '.tmp')
+            with open(temporary_path, 'wb') as file:
+                pickle.dump((key, metadata), file, protocol=pickle.HIGHEST_PROTOCOL)
+            temporary_path.replace(self.filepath)
+        except Exception as e:
+            logger.warning(f'Could not save the schema cache to {self.filepath}: {e}')
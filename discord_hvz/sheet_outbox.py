@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Iterable, Optional, TYPE_CHECKING
+
+import sqlalchemy
+from sqlalchemy import select, delete, update
+
+from discord_hvz.config import config
+
+if TYPE_CHECKING:
+    from discord_hvz.database import HvzDb
+
+HASH_SIZE = 8
+
+
+@dataclass(frozen=True)
+class OutboxEntry:
+    """
+    What the Google Sheet last received of one table. column_order and row_hashes are None while an export is being
+    sent, or if the Sheet may no longer match them, in which case the next export rewrites the whole Sheet.
+    """
+    table: str
+    exported_sequence: int
+    exported_time: Optional[datetime]
+    column_order: Optional[List[str]]
+    row_keys: Optional[List[bytes]]
+    row_hashes: Optional[List[bytes]]
+
+
+class SheetOutbox:
+    """
+    A record, kept in the database, of what each table looked like when it was last exported to the Google Sheet.
+    Each entry holds the change journal's sequence number as of the export, its watermark. Every write is journaled in
+    the same transaction as the write, so a table with journal entries past its watermark has changes the Sheet hasn't
+    seen, even if the bot stopped or Google was down before they were sent. pending_tables() finds those tables.
+    The row and key hashes of the last export are kept too, so the first export after a restart only sends what changed.
+    """
+    table_name = 'sheet_outbox'
+    columns: Dict[str, str] = {
+        'table_name': 'string',
+        'exported_sequence': 'integer',
+        'exported_time': 'timestamp',
+        'column_order': 'string',
+        'row_keys': 'string',
+        'row_hashes': 'string'
+    }
+
+    def __init__(self, db: HvzDb):
+        self.db = db
+        db.prepare_table(self.table_name, self.columns)
+
+    @property
+    def table(self) -> sqlalchemy.Table:
+        # Looked up each time, since switching games makes a new Table
+        return self.db.tables[self.table_name]
+
+    def entries(self) -> Dict[str, OutboxEntry]:
+        with self.db._connect() as conn:
+            rows = conn.execute(select(self.table)).all()
+        return {
+            row.table_name: OutboxEntry(
+                table=row.table_name,
+                exported_sequence=row.exported_sequence or 0,
+                exported_time=row.exported_time,
+                column_order=None if row.column_order is None else row.column_order.split(','),
+                row_keys=None if row.row_keys is None else _split_hashes(bytes.fromhex(row.row_keys)),
+                row_hashes=None if row.row_hashes is None else _split_hashes(bytes.fromhex(row.row_hashes))
+            )
+            for row in rows
+        }
+
+    def pending_tables(self, table_names: Iterable[str]) -> List[str]:
+        """
+        Returns the tables the Sheet is missing changes to: those changed since their last export, those whose last
+        export never finished, and those never exported at all.
+        """
+        entries = self.entries()
+        pending = []
+        for table_name in table_names:
+            entry = entries.get(table_name)
+            if (
+                    entry is None
+                    or entry.row_hashes is None
+                    or self.db.journal.latest_sequence(table_name) > entry.exported_sequence
+            ):
+                pending.append(table_name)
+        return pending
+
+    def begin_export(self, table_names: Iterable[str]) -> None:
+        """
+        Forgets the row hashes of tables about to be sent. If the bot stops mid-request, the Sheet may be partly
+        written, so the next export must rewrite it whole. The watermark is kept, so the tables stay pending.
+        """
+        with self.db._connect() as conn:
+            conn.execute(
+                update(self.table).where(self.table.c.table_name.in_(list(table_names))).values(row_hashes=None)
+            )
+
+    def record_export(self, table_name: str, sequence: int, column_order: List[str], row_keys: Optional[List[bytes]],
+                      row_hashes: List[bytes]) -> None:
+        """Saves a finished export of a table, as of the journal sequence number its rows were read at."""
+        with self.db._connect() as conn:
+            conn.execute(delete(self.table).where(self.table.c.table_name == table_name))
+            conn.execute(self.table.insert(), {
+                'table_name': table_name,
+                'exported_sequence': sequence,
+                'exported_time': datetime.now(tz=config.time_zone),
+                'column_order': ','.join(column_order),
+                'row_keys': None if row_keys is None else b''.join(row_keys).hex(),
+                'row_hashes': b''.join(row_hashes).hex()
+            })
+
+    def forget_snapshots(self) -> None:
+        """Marks every table as needing a full export, such as when another game is about to take over the Sheet."""
+        if self.table_name not in self.db.tables:
+            return  # Not made yet, such as when switching back from a game that failed to open
+        with self.db._connect() as conn:
+            conn.execute(update(self.table).values(row_hashes=None))
+
+
+def _split_hashes(data: bytes) -> List[bytes]:
+    return [data[i:i + HASH_SIZE] for i in range(0, len(data), HASH_SIZE)]
@@ -1,10 +1,15 @@
 from __future__ import print_function, annotations
 
 import asyncio
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, TYPE_CHECKING
+from typing import Dict, List, Tuple, Optional, TYPE_CHECKING
 
 import google.auth.exceptions
 from google.auth.transport.requests import Request
@@ -13,8 +18,9 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from loguru import logger
 
-from .utilities import pool_function
 from .config import config
+from .export_scheduler import ExportScheduler
+from .sheet_outbox import SheetOutbox, HASH_SIZE
 
 if TYPE_CHECKING:
     import sqlalchemy
@@ -31,14 +37,98 @@ CREDENTIALS_PATH = config.path_root / 'credentials.json'
 TOKEN_PATH = config.path_root / 'token.json'
 
 
+@dataclass
+class ExportSnapshot:
+    """
+    The columns, and a hash of each row and of each row's key, in Sheet order, of one table as it was last exported.
+    row_keys is None if the table has no key column, in which case rows can only be compared by position.
+    """
+    column_order: List[str]
+    row_keys: Optional[List[bytes]]
+    row_hashes: List[bytes]
+
+
+def row_hash(row: list) -> bytes:
+    return hashlib.blake2b(repr(row).encode(), digest_size=HASH_SIZE).digest()
+
+
+def removed_runs(old_keys: Optional[List[bytes]], new_keys: Optional[List[bytes]]) -> Optional[List[Tuple[int, int]]]:
+    """
+    Returns the (start, end) row positions of each run of rows in the old export whose keys are gone from the new one,
+    end exclusive. Returns None if rows can't be matched by key, because a key is missing or shared by several rows.
+    """
+    if old_keys is None or new_keys is None:
+        return None
+    new_key_set = set(new_keys)
+    if len(new_key_set) != len(new_keys) or len(set(old_keys)) != len(old_keys):
+        return None
+    runs = []
+    start = None
+    for i, key in enumerate(old_keys):
+        removed = key not in new_key_set
+        if removed and start is None:
+            start = i
+        elif not removed and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(old_keys)))
+    return runs
+
+
+def changed_runs(old_hashes: List[bytes], new_hashes: List[bytes]) -> List[Tuple[int, int]]:
+    """
+    Returns the (start, end) row positions of each run of rows that differ between two exports, end exclusive.
+    Rows past the end of the shorter export count as changed.
+    """
+    runs = []
+    start = None
+    for i in range(max(len(old_hashes), len(new_hashes))):
+        changed = i >= len(old_hashes) or i >= len(new_hashes) or old_hashes[i] != new_hashes[i]
+        if changed and start is None:
+            start = i
+        elif not changed and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, max(len(old_hashes), len(new_hashes))))
+    return runs
+
+
 class SheetsInterface:
     db: HvzDb
     sheet_id: str
 
-    def __init__(self, db: HvzDb):
-        self.setup(db)
-        self.waiting_tables: Dict[str, asyncio.Task] = {}
-        self.sheet_id = config['sheet_id']
+    def __init__(self, db: HvzDb, spreadsheets=None, sheet_id: str = None):
+        """
+        spreadsheets is the Sheets API's spreadsheets resource, normally built from the saved Google login. One can be
+        given instead, such as a stand-in for benchmarks, in which case the login is never used.
+        """
+        self.uses_login = spreadsheets is None
+        if self.uses_login:
+            self.setup(db)
+        else:
+            self.db = db
+            self.spreadsheets = spreadsheets
+        # Kept in the database, so exports that were waiting when the bot stopped are sent by resume()
+        self.outbox = SheetOutbox(db)
+        db.create_tables()
+        # What each table looked like when it was last exported, so the next export only sends what changed
+        self.snapshots: Dict[str, ExportSnapshot] = {
+            table_name: ExportSnapshot(entry.column_order, entry.row_keys, entry.row_hashes)
+            for table_name, entry in self.outbox.entries().items()
+            if entry.row_hashes is not None
+        }
+        # The exporter thread changes the snapshots while the database thread may be reading them
+        self._snapshots_lock = threading.Lock()
+        self.last_exported: Dict[str, datetime] = {}
+        self.sheet_ids: Dict[str, int] = {}
+        # Every request made to Google, so each export can tell the scheduler how much of the quota it used
+        self.requests_sent = 0
+        # Google's API blocks, so exports run on this thread instead of the event loop. One thread keeps them in order.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets')
+        self.scheduler = ExportScheduler(self.export_tables)
+        self.sheet_id = sheet_id or config['sheet_id']
 
     def setup(self, db):
 
@@ -80,6 +170,8 @@ class SheetsInterface:
         self.spreadsheets = service.spreadsheets()
 
     def check_creds(self):
+        if not self.uses_login:
+            return
         if TOKEN_PATH.exists():
             creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), SCOPES)
             if creds.valid:
@@ -87,18 +179,87 @@ class SheetsInterface:
         self.setup(self.db)
 
     def update_table(self, table_name: str):
-        pool_function(
-            function=self._export,
-            wait_seconds=10.0,
-            table_name=table_name
+        # The scheduler decides when to export, sending every changed table in one request
+        self.scheduler.mark_dirty(table_name)
+
+    async def resume(self) -> None:
+        """
+        Schedules an export of every table the outbox shows the Sheet is missing changes to: changes made while the bot
+        was stopped, or that hadn't reached Google when it stopped. Called once the bot is ready, at startup and after
+        a full reconnect to Discord. Exports that fail while the bot runs don't need this, since the scheduler keeps
+        their tables marked as changed and retries them.
+        """
+        try:
+            pending = await self.db.arun(self._pending_tables)
+        except Exception as e:
+            logger.exception(f'Could not check which tables the Google Sheet is missing: {e}')
+            return
+        if pending:
+            logger.info(f'Exporting changes the Google Sheet is missing from: {", ".join(pending)}')
+        for table_name in pending:
+            self.scheduler.mark_dirty(table_name)
+
+    def _pending_tables(self) -> List[str]:
+        pending = self.outbox.pending_tables(self.db.database_config)
+        with self._snapshots_lock:
+            snapshots = dict(self.snapshots)
+        # Columns added while the bot was stopped have no journal entries, but the Sheet still needs them
+        for table_name, snapshot in snapshots.items():
+            if table_name in self.db.database_config and table_name not in pending \
+                    and set(snapshot.column_order) != set(self.db.get_column_names(table_name)):
+                pending.append(table_name)
+        return pending
+
+    async def export_tables(self, table_names: List[str]) -> int:
+        """
+        Exports tables without blocking the event loop. The rows are read on the database thread, then sent to Google
+        from the exporter thread. Exceptions are raised for the scheduler, which retries the export.
+        Each finished export is saved to the outbox, along with the journal sequence number its rows were read at.
+        Returns the number of requests sent to Google, which the scheduler charges to the quota.
+        """
+        start = time.perf_counter()
+        requests_before = self.requests_sent
+        exports, sequences = await self.db.arun(self._begin_export, table_names)
+        loop = asyncio.get_running_loop()
+        updated_cells, snapshots = await loop.run_in_executor(self.executor, self._upload_tables, exports)
+        await self.db.arun(self._record_exports, sequences, snapshots)
+        exported_time = datetime.now(tz=config.time_zone)
+        for table_name in table_names:
+            self.last_exported[table_name] = exported_time
+        logger.debug(
+            f'Exported {", ".join(table_names)} to the Google Sheet in {time.perf_counter() - start:.2f} seconds: '
+            f'{updated_cells} cells updated.'
         )
+        return self.requests_sent - requests_before
+
+    def _begin_export(self, table_names: List[str]) -> Tuple[List[Tuple[str, List[str], List[list]]], Dict[str, int]]:
+        """Reads the tables and their journal sequence numbers in one transaction, so the two always agree."""
+        with self.db.transaction():
+            exports = [(table_name, *self._read_table(table_name)) for table_name in table_names]
+            sequences = {table_name: self.db.journal.latest_sequence(table_name) for table_name in table_names}
+            self.outbox.begin_export(table_names)
+        return exports, sequences
+
+    def _record_exports(self, sequences: Dict[str, int], snapshots: Dict[str, ExportSnapshot]) -> None:
+        with self.db.transaction():
+            for table_name, snapshot in snapshots.items():
+                self.outbox.record_export(
+                    table_name, sequences[table_name], snapshot.column_order, snapshot.row_keys, snapshot.row_hashes
+                )
 
     def _export(self, table_name: str):
-        # TODO: It would be nice if this didn't have to deal directly with the database. Not a huge deal.
-
-        self.check_creds()
+        """Exports a table synchronously, on the calling thread. The bot uses export_tables() instead."""
+        column_order, values = self._read_table(table_name)
+        try:
+            updated_cells, _ = self._upload_tables([(table_name, column_order, values)])
+        except Exception as e:
+            logger.exception('There was an exception with the Google API request! Here it is: %s' % e)
+        else:
+            logger.debug('{0} cells updated.'.format(updated_cells))
 
-        table: List[sqlalchemy.engine.Row] = self.db.get_table(table_name)
+    def _read_table(self, table_name: str) -> Tuple[List[str], List[list]]:
+        """Returns the table's columns in Sheet order, and its rows as lists of values ready for the Sheet."""
+        # TODO: It would be nice if this didn't have to deal directly with the database. Not a huge deal.
         database_columns = self.db.get_column_names(table_name)
 
         column_order: List[str] = []
@@ -112,41 +273,124 @@ class SheetsInterface:
 
         # Let's turn the list of Rows into a list of lists. Google wants that.
 
+        # Rows are streamed with their columns already in order, so only the finished values are held in memory
         values = []
-        for y, row in enumerate(table):
-            values.append([])
-            for x, column in enumerate(column_order):
-                cell = row[column]
-                if isinstance(cell, datetime):
-                    cell = cell.isoformat()
-
-                values[y].append(cell)
-
-
-        values.insert(0, column_order)
-        sheet_name = config['sheet_names'][table_name]
-
-        # Build a string that represents the range to overwrite for Sheets. Example: 'Members'!A:L
-        range = f"'{sheet_name}'"
-        if len(values) == 0:
-            column_count = len(column_order)
-        else:
-            column_count = len(values[0])
-        range += f'!A:{get_column_letter(column_count)}'
-
-
-        # Erases all columns up to the number of columns that could be written.
-        self.spreadsheets.values().clear(spreadsheetId=self.sheet_id, range=range).execute()
-
-        body = {'values': values}
+        for row in self.db.iter_rows(table_name, columns=column_order):
+            values.append([cell.isoformat() if isinstance(cell, datetime) else cell for cell in row])
+        return column_order, values
+
+    def _key_position(self, table_name: str, column_order: List[str]) -> Optional[int]:
+        """The position in the Sheet's columns of the column that identifies the table's rows, if it has one."""
+        key_column = self.db._key_column(self.db.tables[table_name])
+        if key_column is None or key_column.name not in column_order:
+            return None
+        return column_order.index(key_column.name)
+
+    def _upload_tables(self, exports: List[Tuple[str, List[str], List[list]]]) -> Tuple[int, Dict[str, ExportSnapshot]]:
+        """
+        Sends tables to their Sheets, given as (table name, column order, rows). Every table goes in one batchUpdate,
+        with only the rows that changed where possible. Rows are matched to the last export by their key, so rows
+        that were deleted are removed from the Sheet first, in one structural batchUpdate, and the rows below them
+        move up rather than being sent again. A batchClear follows only if a Sheet was rewritten whole.
+        Returns the number of cells updated and the tables' new snapshots. Blocks on Google, so the bot runs this on the
+        exporter thread.
+        """
+        self.check_creds()
 
-        try:
-            result = self.spreadsheets.values().update(spreadsheetId=self.sheet_id, range=range,
-                                                       valueInputOption='USER_ENTERED', body=body).execute()
-        except Exception as e:
-            logger.exception('There was an exception with the Google API request! Here it is: %s' % e)
-        else:
-            logger.debug('{0} cells updated.'.format(result.get('updatedCells')))
+        data = []
+        clear_ranges = []
+        row_deletions: Dict[str, List[Tuple[int, int]]] = {}
+        snapshots = {}
+        for table_name, column_order, values in exports:
+            sheet_name = config['sheet_names'][table_name]
+            key_position = self._key_position(table_name, column_order)
+            snapshot = ExportSnapshot(
+                column_order,
+                None if key_position is None else [row_hash([row[key_position]]) for row in values],
+                [row_hash(row) for row in values]
+            )
+            # If the request fails, the Sheet may be partly written, so having no snapshot makes the next export
+            # rewrite all of it
+            with self._snapshots_lock:
+                previous = self.snapshots.pop(table_name, None)
+            if previous is None or previous.column_order != column_order:
+                data.append(self._full_range(sheet_name, column_order, values))
+                # Row 1 is the header, so the table's last row is at len(values) + 1
+                clear_ranges.append(f"'{sheet_name}'!A{len(values) + 2}:{get_column_letter(len(column_order))}")
+            else:
+                previous_hashes = previous.row_hashes
+                removed = removed_runs(previous.row_keys, snapshot.row_keys)
+                if removed:
+                    row_deletions[sheet_name] = removed
+                    removed_positions = {i for start, end in removed for i in range(start, end)}
+                    # What the Sheet holds once the deleted rows are gone
+                    previous_hashes = [h for i, h in enumerate(previous_hashes) if i not in removed_positions]
+                data.extend(self._changed_ranges(sheet_name, previous_hashes, snapshot, values))
+            snapshots[table_name] = snapshot
+
+        if row_deletions:
+            self._send(self.spreadsheets.batchUpdate(
+                spreadsheetId=self.sheet_id, body={'requests': self._delete_row_requests(row_deletions)}
+            ))
+        updated_cells = 0
+        if data:
+            result = self._send(self.spreadsheets.values().batchUpdate(
+                spreadsheetId=self.sheet_id, body={'valueInputOption': 'USER_ENTERED', 'data': data}
+            ))
+            updated_cells = result.get('totalUpdatedCells', 0)
+        # Cleared after the rows are written, so a Sheet never goes blank
+        if clear_ranges:
+            self._send(self.spreadsheets.values().batchClear(spreadsheetId=self.sheet_id, body={'ranges': clear_ranges}))
+        with self._snapshots_lock:
+            self.snapshots.update(snapshots)
+        return updated_cells, snapshots
+
+    def _send(self, request) -> Dict:
+        """Executes a request to Google, counting it in requests_sent."""
+        self.requests_sent += 1
+        return request.execute()
+
+    def close(self) -> None:
+        """Stops scheduling exports, waits for any export in progress to finish, then releases the exporter thread."""
+        self.scheduler.close()
+        self.executor.shutdown(wait=True)
+
+    @staticmethod
+    def _full_range(sheet_name: str, column_order: List[str], values: List[list]) -> Dict:
+        """The whole Sheet, for the first export or when the columns changed."""
+        return {'range': f"'{sheet_name}'!A1:{get_column_letter(len(column_order))}", 'values': [column_order] + values}
+
+    def _delete_row_requests(self, row_deletions: Dict[str, List[Tuple[int, int]]]) -> List[Dict]:
+        """deleteDimension requests for runs of data rows, by Sheet name. Each Sheet's runs go bottom up."""
+        sheet_ids = self._sheet_ids(list(row_deletions))
+        requests = []
+        for sheet_name, runs in row_deletions.items():
+            for start, end in reversed(runs):
+                # Grid rows count from 0 and row 0 is the header
+                requests.append({'deleteDimension': {'range': {
+                    'sheetId': sheet_ids[sheet_name], 'dimension': 'ROWS', 'startIndex': start + 1, 'endIndex': end + 1
+                }}})
+        return requests
+
+    def _sheet_ids(self, sheet_names: List[str]) -> Dict[str, int]:
+        """The numeric ids of Sheets by name, which structural requests need. Asked of Google once, then kept."""
+        if any(sheet_name not in self.sheet_ids for sheet_name in sheet_names):
+            result = self._send(self.spreadsheets.get(spreadsheetId=self.sheet_id, fields='sheets.properties(sheetId,title)'))
+            self.sheet_ids = {sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in result['sheets']}
+        return self.sheet_ids
+
+    @staticmethod
+    def _changed_ranges(sheet_name: str, previous_hashes: List[bytes], snapshot: ExportSnapshot,
+                        values: List[list]) -> List[Dict]:
+        """The runs of rows that differ from the last export. Rows that no longer exist are overwritten with blanks."""
+        column_count = len(snapshot.column_order)
+        last_column = get_column_letter(column_count)
+        blank_row = [''] * column_count
+        data = []
+        for start, end in changed_runs(previous_hashes, snapshot.row_hashes):
+            run_values = [values[i] if i < len(values) else blank_row for i in range(start, end)]
+            data.append({'range': f"'{sheet_name}'!A{start + 2}:{last_column}{end + 1}", 'values': run_values})
+        return data
 
     # Returns a 2D list of data requested from the specified range in the specified sheet. Range must be given in A1 notation
     # Currently cannot specify which spreadsheet to pull from, but that'll depend on how this function is used
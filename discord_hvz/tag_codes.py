@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import itertools
+import random
+import string
+import threading
+from typing import List, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from discord_hvz.member_cache import MemberCache
+
+
+class TagCodeAllocator:
+    """
+    Hands out unused tag codes without touching the database.
+    Codes come from a shuffled pool, which is refilled in bulk when it runs dry. A code is skipped if a member already
+    has it, according to the member cache, or if it was handed out earlier and maybe not saved yet.
+    The UNIQUE index on members.tag_code is the final guarantee against duplicates.
+    """
+    # Characters that are easily confused with one another are left out
+    code_characters: str = (string.ascii_uppercase + string.digits).translate(str.maketrans('', '', '0125IOUDQVSZ'))
+    code_length: int = 6
+    pool_size: int = 1000
+    # Code spaces at most this big are listed in full when refilling, so allocation can't fail until every code is used
+    max_enumerated_codes: int = 1_000_000
+
+    def __init__(self, member_cache: MemberCache):
+        self.member_cache = member_cache
+        self.allocated: Set[str] = set()
+        self.pool: List[str] = []
+        self._random = random.SystemRandom()
+        self._lock = threading.Lock()  # Chatbots allocate on the event loop, scripts may use other threads
+
+    def allocate(self) -> str:
+        """Returns a tag code that no member has and that hasn't been returned before."""
+        with self._lock:
+            while True:
+                if not self.pool:
+                    self._refill()
+                code = self.pool.pop()
+                if not self._in_use(code):
+                    self.allocated.add(code)
+                    return code
+
+    def _in_use(self, code: str) -> bool:
+        return code in self.allocated or self.member_cache.contains('tag_code', code)
+
+    def _refill(self) -> None:
+        space = len(self.code_characters) ** self.code_length
+        if space <= self.max_enumerated_codes:
+            codes = [
+                ''.join(characters)
+                for characters in itertools.product(self.code_characters, repeat=self.code_length)
+            ]
+            codes = [code for code in codes if not self._in_use(code)]
+            if not codes:
+                raise ValueError('Every possible tag code is in use.')
+            self._random.shuffle(codes)
+            self.pool = codes
+            return
+
+        # The code space is far larger than any game, so random codes rarely collide. Collisions are filtered anyway.
+        codes = set()
+        while len(codes) < self.pool_size:
+            code = ''.join(self._random.choices(self.code_characters, k=self.code_length))
+            if not self._in_use(code):
+                codes.add(code)
+        self.pool = list(codes)
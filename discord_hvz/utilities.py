@@ -1,9 +1,8 @@
 from __future__ import annotations
 import asyncio
-import random
-import string
+import math
 from inspect import iscoroutinefunction
-from typing import Dict, List, TYPE_CHECKING, Union
+from typing import Dict, List, TYPE_CHECKING, Union, Callable, Awaitable, Tuple, Any
 
 import discord
 from discord.ext import pages
@@ -17,21 +16,12 @@ from loguru import logger
 
 log = logger
 
+MAX_MESSAGE_LENGTH = 2000  # Discord's limit
 
-def make_tag_code(db: HvzDb):
-    code_set = (string.ascii_uppercase + string.digits).translate(str.maketrans('', '', '0125IOUDQVSZ'))
 
-    tag_code = ''
-    # Try generating the code three times. If it can't do it in three, something's wrong
-    for i in range(3):
-        for n in range(6):
-            tag_code += code_set[random.randint(0, len(code_set) - 1)]
-        try:
-            db.get_member(tag_code, column='tag_code')
-        except ValueError:
-            return tag_code
-
-    raise ValueError('Could not find valid tag code.')
+def make_tag_code(db: HvzDb) -> str:
+    # Codes come from a pre-generated pool checked against the member cache, so this never queries the database
+    return db.tag_codes.allocate()
 
 
 def member_from_string(member_string, db, ctx=None):
@@ -54,11 +44,13 @@ def member_from_string(member_string, db, ctx=None):
 def generate_tag_tree(db: HvzDb, bot: HVZBot) -> str:
     # oz_table = db.get_rows('members', 'oz', True) Old, easy way of getting OZs.
     oz_table = _get_ozs(bot, db)
+    # One grouped count up front, so players without tags cost no query
+    tag_counts = db.aggregate('tags', 'count', group_by='tagger_id', exclusion_column_name='revoked_tag', exclusion_value=True)
     # └
-    return _tag_tree_loop(db, bot, oz_table, 0)
+    return _tag_tree_loop(db, bot, oz_table, 0, tag_counts)
 
 
-def _tag_tree_loop(db: HvzDb, bot: HVZBot, table: List[sqlalchemy.engine.Row], level: int) -> str:
+def _tag_tree_loop(db: HvzDb, bot: HVZBot, table: List[sqlalchemy.engine.Row], level: int, tag_counts: Dict[str, int]) -> str:
     output = ''
     for i, row in enumerate(table):
         output += '\n'
@@ -68,22 +60,19 @@ def _tag_tree_loop(db: HvzDb, bot: HVZBot, table: List[sqlalchemy.engine.Row], l
             output += f'<@{row.id}>'
         else:
             output += f'{row.name}'
-        try:
-            tags = db.get_rows('tags', 'tagger_id', row.id, exclusion_column_name='revoked_tag', exclusion_value=True)
-        # If the player had no tags...
-        except ValueError:
-            pass
+        tag_count = tag_counts.get(str(row.id), 0)
         # If the player had tags...
-        else:
-            output += f', {len(tags)} tag'
-            if len(tags) > 1:
+        if tag_count > 0:
+            tags = db.get_rows('tags', 'tagger_id', row.id, exclusion_column_name='revoked_tag', exclusion_value=True)
+            output += f', {tag_count} tag'
+            if tag_count > 1:
                 output += 's'
             output += ':'
             tagged_members = []
             for tag_row in tags:
                 tagged_members.append(db.get_member(tag_row.tagged_id))
 
-            output += _tag_tree_loop(db, bot, tagged_members, level + 1)
+            output += _tag_tree_loop(db, bot, tagged_members, level + 1, tag_counts)
 
     return output
 
@@ -133,6 +122,103 @@ async def respond_paginated(context: discord.ApplicationContext, message: str, m
     await paginator.respond(context.interaction, **kwargs)
 
 
+class LazyPaginator(pages.Paginator):
+    """
+    A Paginator that builds each page only when a user first flips to it.
+    fetch_page is given the key returned with the previous page (None for the first) and returns the page's content
+    and the key for the next page, or None as the key if nothing comes after it. Jumping ahead fetches the pages in
+    between, since each key comes from the page before. page_count is only an estimate: a page is added when the last
+    one turns out not to be the end, and pages past the end show empty_page.
+    """
+
+    def __init__(self, fetch_page: Callable[[Any], Awaitable[Tuple[str, Any]]], page_count: int,
+                 empty_page: str = 'Nothing more to show.', **kwargs):
+        # Placeholders, so the Paginator knows how many pages there are
+        super().__init__(pages=['...'] * max(page_count, 1), **kwargs)
+        self.fetch_page = fetch_page
+        self.empty_page = empty_page
+        self.loaded_pages = 0
+        self.next_key = None
+        self.finished = False
+
+    async def load_through(self, page_number: int) -> None:
+        while self.loaded_pages <= min(page_number, self.page_count):
+            if self.finished:
+                self.pages[self.loaded_pages] = self.empty_page
+            else:
+                self.pages[self.loaded_pages], self.next_key = await self.fetch_page(self.next_key)
+                self.finished = self.next_key is None
+            self.loaded_pages += 1
+            if not self.finished and self.loaded_pages == len(self.pages):
+                self.pages.append('...')
+                self.page_count = len(self.pages) - 1
+
+    async def goto_page(self, page_number: int = 0, *, interaction: discord.Interaction = None) -> None:
+        await self.load_through(page_number)
+        await super().goto_page(page_number, interaction=interaction)
+
+    async def respond(self, interaction: discord.Interaction, *args, **kwargs):
+        await self.load_through(self.current_page)
+        return await super().respond(interaction, *args, **kwargs)
+
+
+async def respond_paginated_rows(
+        context: discord.ApplicationContext,
+        db: HvzDb,
+        table: str,
+        format_row: Callable[[sqlalchemy.engine.Row], str],
+        header: str = '',
+        order_by: str = 'id',
+        columns: List[str] = None,
+        search_column_name: str = None,
+        search_value=None,
+        rows_per_page: int = 15,
+        **kwargs
+) -> bool:
+    """
+    Responds with the rows of a table, one page of rows per message page, using format_row to make each row's line.
+    Only the page being shown is read from the database. Each page holds up to rows_per_page rows, fewer if their lines
+    would pass Discord's message length limit. Returns False, without responding, if there are no rows.
+    """
+    row_count = await db.acount_rows(table, search_column_name, search_value)
+    if row_count == 0:
+        return False
+
+    async def fetch_page(after_key) -> Tuple[str, Any]:
+        # One row more than fits, to tell whether this is the last page
+        rows = await db.apage(
+            table, order_by, after_key, rows_per_page + 1, columns=columns,
+            search_column_name=search_column_name, search_value=search_value
+        )
+        if not rows:
+            return 'No more rows.', None
+        content = header
+        shown = 0
+        for row in rows[:rows_per_page]:
+            line = format_row(row)
+            if shown and len(content) + len(line) > MAX_MESSAGE_LENGTH:
+                break  # Left for the next page
+            content += line
+            shown += 1
+        if len(content) > MAX_MESSAGE_LENGTH:
+            # A single row too long for a message. Rows are never split across pages, so it is cut short.
+            content = content[:MAX_MESSAGE_LENGTH - 1] + '…'
+        if shown == len(rows):
+            return content, None
+        return content, getattr(rows[shown - 1], order_by)
+
+    page_count = math.ceil(row_count / rows_per_page)
+    if page_count == 1:
+        content, next_key = await fetch_page(None)
+        if next_key is None:
+            await context.respond(content, **kwargs)
+            return True
+        page_count = 2  # The rows didn't fit in one message after all
+    paginator = LazyPaginator(fetch_page, page_count, empty_page='No more rows.')
+    await paginator.respond(context.interaction, **kwargs)
+    return True
+
+
 def _get_ozs(bot: "HVZBot", db: HvzDb) -> List[sqlalchemy.engine.Row]:
     """
     This function identifies OZs without relying on the OZ tag.
@@ -140,25 +226,24 @@ def _get_ozs(bot: "HVZBot", db: HvzDb) -> List[sqlalchemy.engine.Row]:
     :param db:
     :return:
     """
-    tags = db.get_table('tags')
     set_of_all_zombies = set()
+    set_of_tagged = set()
     oz_member_rows = []
 
     # Adds anyone who has made a tag. Since it is a Set, there will be no duplicates
-    for tag in tags:
+    for tag in db.iter_rows('tags', columns=['tagger_id', 'tagged_id']):
         set_of_all_zombies.add(int(tag.tagger_id))
+        if tag.tagged_id is not None:
+            set_of_tagged.add(int(tag.tagged_id))
 
     # Adds anyone with the zombie role. The only new ids added should be from OZs who have made no tags.
     for zombie_member in bot.roles['zombie'].members:
         set_of_all_zombies.add(zombie_member.id)
 
     for tagger_id in set_of_all_zombies:
-        try:
-            # If a zombie has been tagged, do nothing.
-            db.get_rows('tags', 'tagged_id', tagger_id)
+        # If a zombie has been tagged, do nothing.
+        if tagger_id in set_of_tagged:
             continue
-        except ValueError:
-            pass
         try:
             # If a zombie has not been tagged, add them to the OZ list
             oz_member_rows.append(db.get_member(tagger_id))